@@ -1,15 +1,27 @@
 from __future__ import annotations
 
 import functools
+import hashlib
+import inspect
 import os
+import pickle
 import shutil
+import tempfile
+import types
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Callable, Iterable
+
+import numpy as np
+import pandas as pd
+
+from data.attribute import Attribute, ATTR_TO_CACHE_MAPPER, CACHE_TO_ATTR_MAPPER
 
 VERSION_DATE = datetime(2022, 12, 28, tzinfo=timezone.utc)
 CACHE_ROOT = Path(os.getcwd()).joinpath('data_cache')
 VERSION_FILE = '.version'
+MEMO_SUFFIX = '.memo'
 
 
 def _verify_cache_dir(path: Path, versions: tuple[datetime, ...]):
@@ -37,12 +49,16 @@ class Cache:
     id: str
     version: datetime = VERSION_DATE
     dependencies: tuple[Cache, ...] = ()
+    # Maximum total size in bytes of the memoized results, least recently used ones are evicted first
+    max_size: int | None = None
 
     @property
     def all_dependencies(self) -> tuple[Cache, ...]:
-        return tuple(set().union(
-            dep.all_dependencies
+        """Direct and transitive dependencies, each once and in a stable (depth-first) order."""
+        return tuple(dict.fromkeys(
+            cache
             for dep in self.dependencies
+            for cache in (dep,) + dep.all_dependencies
         ))
 
     def dir(self) -> Path:
@@ -51,5 +67,290 @@ class Cache:
         _verify_cache_dir(cache_dir, versions)
         return cache_dir
 
+    def file(self, name: str, stamp: str) -> Path:
+        """
+        Path of a cache file (or directory) for a stamp (e.g. from `source_stamp` or `Memoized.key`).
+
+        Files with the same name for other stamps are removed.
+        """
+        stem, suffix = os.path.splitext(name)
+        cache_dir = self.dir()
+        for stale_file in cache_dir.glob(f'{stem}.*{suffix}'):
+            if stale_file.name == f'{stem}.{stamp}{suffix}':
+                continue
+            if stale_file.is_dir():
+                shutil.rmtree(stale_file)
+            else:
+                stale_file.unlink()
+        return cache_dir.joinpath(f'{stem}.{stamp}{suffix}')
+
+    def evict(self, keep: Path = None):
+        """Remove the least recently used memoized results until `max_size` is satisfied."""
+        if self.max_size is None:
+            return
+        files = sorted(
+            (path for path in self.dir().glob(f'*{MEMO_SUFFIX}.*') if path.is_file()),
+            key=lambda path: path.stat().st_mtime_ns
+        )
+        total_size = sum(path.stat().st_size for path in files)
+        for path in files:
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            total_size -= path.stat().st_size
+            path.unlink()
+
+
+def source_stamp(*sources: Path | str) -> str:
+    """Short hash of the size and modification time of source files."""
+    digest = hashlib.sha1()
+    for source in sources:
+        stat = os.stat(source)
+        digest.update(f'{os.fspath(source)}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+@functools.cache
+def _content_hash(path: str, size: int, mtime_ns: int) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_stamp(*sources: Path | str) -> str:
+    """
+    Short hash of the contents of source files.
+
+    Files are only read again when their size or modification time changed.
+    """
+    digest = hashlib.sha1()
+    for source in sources:
+        stat = os.stat(source)
+        digest.update(_content_hash(os.fspath(source), stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()[:16]
+
+
+def _update_fingerprint(digest, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr((type(value).__name__, value.shape, list(value.dtypes)
+                            if isinstance(value, pd.DataFrame) else value.dtype)).encode())
+        if isinstance(value, pd.DataFrame):
+            _update_fingerprint(digest, tuple(value.columns))
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, pd.Index):
+        digest.update(repr(('Index', len(value), value.dtype)).encode())
+        digest.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr(('ndarray', value.shape, value.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'{type(value).__name__}:{len(value)}'.encode())
+        for item in value:
+            _update_fingerprint(digest, item)
+    elif isinstance(value, dict):
+        digest.update(f'dict:{len(value)}'.encode())
+        for key, item in sorted(value.items(), key=lambda entry: repr(entry[0])):
+            _update_fingerprint(digest, key)
+            _update_fingerprint(digest, item)
+    elif isinstance(value, (set, frozenset)):
+        _update_fingerprint(digest, sorted(value, key=repr))
+    elif value is None or isinstance(value, (bool, int, float, str, bytes, datetime, Path, Attribute, np.generic)):
+        digest.update(repr(value).encode())
+    else:
+        digest.update(pickle.dumps(value))
+
+
+def fingerprint(*values) -> str:
+    """Stable hash of plain values, containers, arrays and pandas objects (including their index)."""
+    digest = hashlib.sha1()
+    for value in values:
+        _update_fingerprint(digest, value)
+    return digest.hexdigest()
+
+
+def _code_fingerprint(digest, code: types.CodeType):
+    # Code objects are hashed by their bytecode, names and constants (nested functions recursively),
+    # so only changes to the function itself invalidate its results
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_fingerprint(digest, const)
+        else:
+            digest.update(repr(const).encode())
+
+
+def _module_source(obj) -> str | None:
+    """Source file of the module defining a function, if any (e.g. not for functions of a notebook)."""
+    module = inspect.getmodule(obj)
+    try:
+        return inspect.getsourcefile(module) if module is not None else None
+    except TypeError:
+        return None
+
+
+def _is_feather_frame(df: pd.DataFrame) -> bool:
+    """Whether a DataFrame can be stored as feather and read back identically."""
+    cache_columns = [ATTR_TO_CACHE_MAPPER.get(column, column) for column in df.columns]
+    return (
+        isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1
+        and df.index.name is None
+        and all(isinstance(column, (str, Attribute)) for column in df.columns)
+        and len(set(cache_columns)) == len(cache_columns)
+        # Plain columns named like an attribute would be read back as the attribute
+        and not any(isinstance(column, str) and column in CACHE_TO_ATTR_MAPPER for column in df.columns)
+    )
+
+
+class Memoized:
+    """
+    A function whose results are cached in memory and on disk, see `memoize`.
+    """
+
+    def __init__(self, func: Callable, cache: Cache, sources: tuple[str, ...], version, helpers: tuple[Callable, ...],
+                 hash_sources: bool, dependencies: tuple[Memoized, ...], memory: bool, disk: bool):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.cache = cache
+        self.sources = sources
+        self.version = version
+        # Modules defining the function and its helpers, their whole source is tracked
+        self.code_sources = tuple(dict.fromkeys(
+            source for source in (_module_source(obj) for obj in (func,) + helpers) if source is not None
+        ))
+        self.hash_sources = hash_sources
+        self.dependencies = dependencies
+        self.memory = memory
+        self.disk = disk
+        self._signature = inspect.signature(func)
+        self._results = {}
+
+    def static_key(self) -> str:
+        """
+        Hash of everything but the arguments: the function code, the source of its module (and of the
+        helpers' modules) and version, the current state of the source files and the static keys of all
+        dependencies (and so theirs, transitively).
+        """
+        digest = hashlib.sha1(f'{self.func.__module__}.{self.func.__qualname__}:{self.version!r}'.encode())
+        _code_fingerprint(digest, self.func.__code__)
+        digest.update(content_stamp(*self.code_sources).encode())
+        digest.update((content_stamp if self.hash_sources else source_stamp)(*self.sources).encode())
+        for dependency in self.dependencies:
+            digest.update(dependency.static_key().encode())
+        return digest.hexdigest()[:16]
+
+    def key(self, *args, **kwargs) -> str:
+        """Key of the result for the given arguments (after applying defaults)."""
+        arguments = self._signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        return f'{self.static_key()}.{fingerprint(dict(arguments.arguments))[:16]}'
+
+    def _path(self, key: str, suffix: str) -> Path:
+        return self.cache.dir().joinpath(f'{self.func.__qualname__}.{key}{MEMO_SUFFIX}{suffix}')
+
+    def _load(self, key: str):
+        for suffix in ('.feather', '.pkl'):
+            path = self._path(key, suffix)
+            if path.exists():
+                # Mark as recently used for the eviction
+                os.utime(path)
+                if suffix == '.feather':
+                    return pd.read_feather(path).rename(CACHE_TO_ATTR_MAPPER, axis=1)
+                return pickle.loads(path.read_bytes())
+        raise FileNotFoundError(self._path(key, ''))
+
+    def _store(self, key: str, result):
+        # Results for other code versions, sources or dependencies can never be used again
+        static_key = key.split('.')[0]
+        for stale_path in self.cache.dir().glob(f'{self.func.__qualname__}.*{MEMO_SUFFIX}.*'):
+            if not stale_path.name.startswith(f'{self.func.__qualname__}.{static_key}.'):
+                stale_path.unlink()
+
+        is_feather = isinstance(result, pd.DataFrame) and _is_feather_frame(result)
+        path = self._path(key, '.feather' if is_feather else '.pkl')
+        # Written to a temporary file of its own first to never leave an incomplete result behind,
+        # even when several processes store the same result
+        with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'.{self.func.__qualname__}.{key}.',
+                                         suffix='.tmp', delete=False) as tmp_file:
+            tmp_path = Path(tmp_file.name)
+            try:
+                if is_feather:
+                    result.rename(ATTR_TO_CACHE_MAPPER, axis=1).to_feather(tmp_file)
+                else:
+                    pickle.dump(result, tmp_file, protocol=pickle.HIGHEST_PROTOCOL)
+            except BaseException:
+                tmp_file.close()
+                tmp_path.unlink()
+                raise
+        tmp_path.replace(path)
+        self.cache.evict(keep=path)
+
+    def __call__(self, *args, **kwargs):
+        key = self.key(*args, **kwargs)
+        if key in self._results:
+            return self._results[key]
+        try:
+            if not self.disk:
+                raise FileNotFoundError(key)
+            result = self._load(key)
+        except FileNotFoundError:
+            result = self.func(*args, **kwargs)
+            if self.disk:
+                self._store(key, result)
+        if self.memory:
+            self._results[key] = result
+        return result
+
+    def cache_clear(self):
+        """Forget the results kept in memory (the results on disk are kept)."""
+        self._results.clear()
+
+
+def memoize(
+        cache: Cache,
+        sources: Iterable[Path | str] = (),
+        version=None,
+        helpers: Iterable[Callable] = (),
+        hash_sources: bool = False,
+        dependencies: Iterable[Memoized] = (),
+        memory: bool = True,
+        disk: bool = True,
+) -> Callable[[Callable], Memoized]:
+    """
+    Cache the results of a function in memory and on disk in the cache directory.
+
+    Results are keyed on the function's code, the source of its module and of the modules of its
+    `helpers`, `version`, the size and modification time (or the contents, if `hash_sources`) of
+    the raw `sources`, the keys of the memoized functions it depends on and its arguments.
+    Changing any of them (e.g. a helper in the same module or a raw file of a dependency)
+    invalidates the result. DataFrames with a default index are stored as feather, all other
+    results are pickled.
+
+    Args:
+        cache: The cache to store the results in, its `max_size` bounds their total size
+        sources: Raw files the result is derived from
+        version: Bump to invalidate the results when nothing tracked changed (e.g. an installed package)
+        helpers: Functions of other modules the function calls, the source of their modules is tracked
+        hash_sources: Whether to hash the contents of the sources instead of their size and modification time
+        dependencies: Memoized functions whose results the function uses
+        memory: Whether to keep the results in memory (e.g. not for intermediate results)
+        disk: Whether to store the results on disk
+
+    Returns:
+        Decorator returning a `Memoized` function
+    """
+    def decorator(func: Callable) -> Memoized:
+        return Memoized(func, cache, tuple(os.fspath(source) for source in sources), version, tuple(helpers),
+                        hash_sources, tuple(dependencies), memory, disk)
+    return decorator
+
 
-POPULATION_CACHE = Cache('population', version=datetime(2025, 4, 11))
+LOCATION_CACHE = Cache('location', version=datetime(2026, 10, 18))
+POPULATION_CACHE = Cache('population', version=datetime(2026, 10, 18))
+SELECTS_CACHE = Cache('selects', version=datetime(2026, 10, 18))
+ELECTION_CACHE = Cache('election', version=datetime(2026, 10, 18))
+RAKING_CACHE = Cache('raking', version=datetime(2026, 10, 18))
+WEIGHTS_CACHE = Cache('weights', version=datetime(2026, 10, 18), max_size=2 * 1024 ** 3)
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Hashable, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from data.attribute import YEAR_ATTR
+from data.cache import LOCATION_CACHE, memoize
+from data.location import COMMUNE_ATTR, CommuneRegistry, get_commune_registry, load_communes_metadata
+
+
+def _registry_date(year: int) -> datetime:
+    """Communes of a year are the communes at its start, like `load_communes_metadata_year`."""
+    return datetime(year, 1, 1)
+
+
+def mutation_matrix(registry: CommuneRegistry) -> sparse.csr_matrix:
+    """
+    The mutation graph of the registry records as a sparse matrix of shape ``(n_records, n_records)``:
+    every record abolished by a mutation goes to the records admitted by the same mutation.
+
+    A record continues as the admitted record with its own commune number (e.g. after a merger into it
+    or a territory exchange), otherwise it is split equally over the admitted records.
+    """
+    df = registry.df
+    records = pd.DataFrame({
+        'record': np.arange(len(df)),
+        'commune': df[COMMUNE_ATTR].to_numpy(np.int64, na_value=-1),
+    })
+    sources = records[df['municipalityAbolitionNumber'].notna().to_numpy()].assign(
+        mutation=df['municipalityAbolitionNumber'].dropna().to_numpy()
+    )
+    targets = records[df['municipalityAdmissionNumber'].notna().to_numpy()].assign(
+        mutation=df['municipalityAdmissionNumber'].dropna().to_numpy()
+    )
+    edges = sources.merge(targets, on='mutation', suffixes=('', '_target'))
+
+    edge_sources = edges['record'].to_numpy()
+    continues = edges['commune'].to_numpy() == edges['commune_target'].to_numpy()
+    has_continuation = np.bincount(edge_sources, weights=continues, minlength=len(df)) > 0
+    is_edge = continues | ~has_continuation[edge_sources]
+    sources, targets = edges['record'].to_numpy()[is_edge], edges['record_target'].to_numpy()[is_edge]
+    counts = np.bincount(sources, minlength=len(df))
+    return sparse.csr_matrix(
+        (1.0 / counts[sources], (sources, targets)), shape=(len(df), len(df))
+    )
+
+
+@dataclass(frozen=True)
+class CommuneMapping:
+    """
+    Sparse mapping of the communes of one year to the communes of another year, of shape
+    ``(n_source_communes, n_target_communes)``: the share of every source commune in every target commune.
+    """
+    source_year: int
+    target_year: int
+    sources: pd.Index  # Commune codes of the source year
+    targets: pd.Index  # Commune codes of the target year
+    matrix: sparse.csr_matrix
+
+    def transpose(self, weights: np.ndarray | pd.Series = None) -> CommuneMapping:
+        """
+        The reverse mapping, splitting every target commune over its source communes by their weights.
+
+        Args:
+            weights: Weight of every source commune, e.g. its population (default: equal weights),
+                a Series is aligned on the source communes
+        """
+        if weights is None:
+            weights = np.ones(len(self.sources))
+        elif isinstance(weights, pd.Series):
+            weights = weights.reindex(self.sources).to_numpy(np.float64, na_value=0.0)
+        weighted = sparse.diags(np.asarray(weights, dtype=np.float64)) @ self.matrix
+        totals = np.asarray(weighted.sum(axis=0)).ravel()
+        with np.errstate(divide='ignore'):
+            normalized = weighted @ sparse.diags(np.where(totals > 0, 1 / totals, 0.0))
+        return CommuneMapping(
+            source_year=self.target_year,
+            target_year=self.source_year,
+            sources=self.targets,
+            targets=self.sources,
+            matrix=normalized.T.tocsr(),
+        )
+
+    def apply(self, values: np.ndarray) -> np.ndarray:
+        """Values of shape ``(n_source_communes, ...)`` summed onto the target communes, of shape ``(n_target_communes, ...)``."""
+        values = np.asarray(values, dtype=np.float64)
+        flat = values.reshape(len(self.sources), -1)
+        return (self.matrix.T @ flat).reshape((len(self.targets),) + values.shape[1:])
+
+    def harmonize_frame(
+            self,
+            df: pd.DataFrame,
+            values: Sequence[Hashable],
+            by: Sequence[Hashable] = (),
+            commune_column: Hashable = COMMUNE_ATTR,
+    ) -> pd.DataFrame:
+        """
+        Sum the value columns of a table onto the target communes, with one sparse product.
+
+        Rows of communes that are not communes of the source year are left out, as are target rows
+        whose values are all zero.
+
+        Args:
+            df: The table, with one row per commune (and other keys, e.g. sex and age)
+            values: The value columns to sum (e.g. population or votes)
+            by: The other key columns
+            commune_column: The commune column
+
+        Returns:
+            The table with the key columns, the target commune and the summed values
+        """
+        values, by = list(values), list(by)
+        if by:
+            grouped = df.groupby(by, sort=False, observed=True, dropna=False)
+            group_codes, groups = grouped.ngroup().to_numpy(np.int64), grouped.size().index
+        else:
+            group_codes, groups = np.zeros(len(df), dtype=np.int64), None
+        n_groups = 1 if groups is None else len(groups)
+        commune_positions = self.sources.get_indexer(df[commune_column].to_numpy(np.int64, na_value=-1))
+        is_known = commune_positions >= 0
+
+        # Values of every source commune in one column per group and value column
+        columns = (group_codes[is_known, None] * len(values) + np.arange(len(values))).ravel()
+        source_values = sparse.csr_matrix((
+            df[values].to_numpy(np.float64, na_value=0.0)[is_known].ravel(),
+            (np.repeat(commune_positions[is_known], len(values)), columns)
+        ), shape=(len(self.sources), n_groups * len(values)))
+        target_values = (self.matrix.T @ source_values).tocoo()
+
+        # Back to one row per target commune and group
+        cells, cell_positions = np.unique(
+            target_values.row * n_groups + target_values.col // len(values), return_inverse=True
+        )
+        summed = np.zeros((len(cells), len(values)))
+        summed[cell_positions, target_values.col % len(values)] = target_values.data
+        result = pd.DataFrame(index=pd.RangeIndex(len(cells))) if groups is None else \
+            groups.take(cells % n_groups).to_frame(index=False)
+        result[commune_column] = pd.array(self.targets.take(cells // n_groups), dtype=COMMUNE_ATTR.type)
+        for i, column in enumerate(values):
+            result[column] = summed[:, i]
+        return result
+
+
+def _year_communes(registry: CommuneRegistry, year: int) -> tuple[np.ndarray, pd.Index]:
+    """Registry rows and commune codes of the communes of a year."""
+    rows = registry.valid_rows(_registry_date(year))
+    return rows, pd.Index(registry.df[COMMUNE_ATTR].to_numpy(np.int64)[rows], name=COMMUNE_ATTR)
+
+
+@memoize(LOCATION_CACHE, dependencies=(load_communes_metadata, get_commune_registry))
+def get_commune_mapping(source_year: int, target_year: int) -> CommuneMapping:
+    """
+    Mapping of the communes of one year onto the communes of another year, see `CommuneMapping`.
+
+    Forward in time, every commune follows its mutations (see `mutation_matrix`) until the target year.
+    Backward in time, every commune is split equally over the communes it came from, see
+    `CommuneMapping.transpose` for other weights.
+    """
+    if target_year < source_year:
+        return get_commune_mapping(target_year, source_year).transpose()
+    registry = get_commune_registry()
+    source_rows, sources = _year_communes(registry, source_year)
+    target_rows, targets = _year_communes(registry, target_year)
+
+    # Records abolished until the target year go to their successors, the others stay
+    mutations = mutation_matrix(registry)
+    abolition_dates = registry.df['municipalityAbolitionDate']
+    is_abolished = (
+            (abolition_dates.notna() & (abolition_dates <= _registry_date(target_year))).to_numpy()
+            & (np.diff(mutations.indptr) > 0)
+    )
+    transitions = sparse.diags((~is_abolished).astype(np.float64)) + sparse.diags(is_abolished.astype(np.float64)) @ mutations
+
+    mapping = sparse.csr_matrix(
+        (np.ones(len(source_rows)), (np.arange(len(source_rows)), source_rows)),
+        shape=(len(source_rows), len(registry.df)),
+    )
+    # Every step follows one more mutation, until all communes reached their records of the target year
+    for _ in range(len(registry.df)):
+        next_mapping = (mapping @ transitions).tocsr()
+        if (next_mapping != mapping).nnz == 0:
+            break
+        mapping = next_mapping
+    target_selector = sparse.csr_matrix(
+        (np.ones(len(target_rows)), (target_rows, np.arange(len(target_rows)))),
+        shape=(len(registry.df), len(target_rows)),
+    )
+    return CommuneMapping(
+        source_year=source_year,
+        target_year=target_year,
+        sources=sources,
+        targets=targets,
+        matrix=(mapping @ target_selector).tocsr(),
+    )
+
+
+def harmonize_years(
+        df: pd.DataFrame,
+        target_year: int,
+        values: Sequence[Hashable],
+        by: Sequence[Hashable] = (),
+        commune_column: Hashable = COMMUNE_ATTR,
+        year_column: Hashable = YEAR_ATTR,
+) -> pd.DataFrame:
+    """
+    Sum the value columns of a table over many years onto the communes of one year,
+    with the mapping of every year (see `get_commune_mapping` and `CommuneMapping.harmonize_frame`).
+    """
+    frames = []
+    for year, year_df in df.groupby(year_column, sort=True, observed=True):
+        frame = get_commune_mapping(int(year), target_year).harmonize_frame(year_df, values, by, commune_column)
+        frame.insert(0, year_column, np.full(len(frame), year, dtype=df[year_column].dtype))
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
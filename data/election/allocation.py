@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+from typing import Mapping
+
+import numpy as np
+import pandas as pd
+
+from data.election.columns import CANTON_COLUMN, LIST_CONNECTION_COLUMN, LIST_SUB_CONNECTION_COLUMN, LIST_VOTES_COLUMN
+
+DHONDT = 'dhondt'  # Equivalent to Hagenbach-Bischoff
+SAINTE_LAGUE = 'sainte_lague'
+ALLOCATION_METHODS = (DHONDT, SAINTE_LAGUE)
+
+# National Council seats per canton (by 'kanton_nummer') for the 2019 election, used by normal_election.ipynb
+NATIONAL_COUNCIL_SEATS_2019 = {
+    1: 35, 2: 24, 3: 9, 4: 1, 5: 4, 6: 1, 7: 1, 8: 1, 9: 3, 10: 7,
+    11: 6, 12: 5, 13: 7, 14: 2, 15: 1, 16: 1, 17: 12, 18: 5, 19: 16,
+    20: 6, 21: 8, 22: 19, 23: 8, 24: 4, 25: 12, 26: 2
+}
+
+
+def _check_method(method: str):
+    if method not in ALLOCATION_METHODS:
+        raise ValueError(f"Unknown allocation method {method}, expected one of {ALLOCATION_METHODS}")
+
+
+def _divisors(seats: np.ndarray, method: str) -> np.ndarray:
+    """Divisor of the next seat of an entity that already has `seats` seats."""
+    return seats + 1.0 if method == DHONDT else 2.0 * seats + 1.0
+
+
+def highest_averages(votes: np.ndarray, seats: np.ndarray, method: str = DHONDT) -> np.ndarray:
+    """
+    Allocate seats to entities by the highest averages (divisor) method, for many independent
+    allocations at once.
+
+    Every seat goes to the entity with the highest next quotient ``votes / divisor``, ties go to
+    the entity with more votes and then to the first one (instead of drawing lots). All allocations advance together, one
+    seat per step, by taking the best quotient of every allocation (like popping a heap of the
+    next quotients). For D'Hondt, every entity starts with the seats it certainly wins
+    (one below its lower quota), so only the last few seats need steps.
+
+    Args:
+        votes: Votes of shape ``(..., n_entities)``, entities without votes get no seats
+        seats: Seats to allocate of shape ``(...)`` (broadcast against the votes)
+        method: The divisor method, see `ALLOCATION_METHODS`
+
+    Returns:
+        Seats of every entity, of the shape of the votes
+    """
+    votes = np.asarray(votes, dtype=np.float64)
+    seats = np.broadcast_to(np.asarray(seats, dtype=np.int64), votes.shape[:-1])
+    _check_method(method)
+    if votes.shape[-1] == 0:
+        return np.zeros(votes.shape, dtype=np.int64)
+    has_votes = votes > 0
+    total_votes = votes.sum(axis=-1, where=has_votes)
+
+    if method == DHONDT:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lower_quota = np.floor(votes * (seats / total_votes)[..., None]) - 1
+        won = np.where(has_votes & np.isfinite(lower_quota), np.maximum(lower_quota, 0), 0).astype(np.int64)
+    else:
+        won = np.zeros(votes.shape, dtype=np.int64)
+
+    remaining = seats - won.sum(axis=-1)
+    tie_votes = np.where(has_votes, votes, -np.inf)
+    for step in range(int(remaining.max(initial=0))):
+        quotients = np.where(has_votes, votes / _divisors(won, method), -np.inf)
+        best = quotients.max(axis=-1, keepdims=True)
+        chosen = np.argmax(np.where(quotients == best, tie_votes, -np.inf), axis=-1)
+        is_allocating = (remaining > step) & np.isfinite(best[..., 0])
+        np.put_along_axis(
+            won, chosen[..., None],
+            np.take_along_axis(won, chosen[..., None], axis=-1) + is_allocating[..., None],
+            axis=-1
+        )
+    return won
+
+
+class _Level:
+    """
+    Entities of one level of the allocation (e.g. list connections), contiguous per segment
+    (the entity of the level above they are allocated within).
+    """
+
+    def __init__(self, segments: np.ndarray, n_segments: int):
+        self.segments = segments
+        self.n_segments = n_segments
+        # Position of every entity within its segment, entities are sorted by segment
+        starts = np.searchsorted(segments, np.arange(n_segments))
+        self.positions = np.arange(len(segments)) - starts[segments]
+        self.width = int(self.positions.max(initial=-1)) + 1
+
+    def allocate(self, votes: np.ndarray, seats: np.ndarray, method: str) -> np.ndarray:
+        """Allocate the seats of every segment ``(..., n_segments)`` to its entities ``(..., n_entities)``."""
+        padded = np.zeros(votes.shape[:-1] + (self.n_segments, self.width))
+        padded[..., self.segments, self.positions] = votes
+        return highest_averages(padded, seats, method)[..., self.segments, self.positions]
+
+
+def _group_starts(keys: list[np.ndarray]) -> np.ndarray:
+    """Positions where any of the (sorted) keys changes."""
+    changes = np.zeros(len(keys[0]), dtype=bool)
+    if len(changes):
+        changes[0] = True
+    for key in keys:
+        changes[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(changes)
+
+
+class SeatAllocator:
+    """
+    Hierarchical proportional seat allocation of list elections, compiled once for a set of lists.
+
+    The seats of every canton are allocated to its list connections, the seats of every
+    connection to its sub-connections and the seats of every sub-connection to its lists.
+    Lists without (sub-)connection form a (sub-)connection of their own. All cantons (and any
+    number of vote scenarios) are allocated together, see `allocate`.
+    """
+
+    def __init__(
+            self,
+            cantons: np.ndarray,
+            connections: np.ndarray,
+            sub_connections: np.ndarray,
+            seats_per_canton: Mapping[int, int],
+            method: str = DHONDT,
+    ):
+        """
+        Args:
+            cantons: Canton of every list
+            connections: Connection code of every list (missing for lists without connection)
+            sub_connections: Sub-connection code of every list (missing for lists without sub-connection)
+            seats_per_canton: Seats of every canton, cantons without seats get none
+            method: The divisor method, see `ALLOCATION_METHODS`
+        """
+        _check_method(method)
+        self.method = method
+        n_lists = len(cantons)
+        canton_codes, self.cantons = pd.factorize(pd.Series(cantons), sort=True)
+        list_ids = np.arange(n_lists)
+        # Lists without (sub-)connection are their own (sub-)connection, after the (sorted) connections
+        # and in list order, which decides ties between equal votes
+        connection_codes, connection_uniques = pd.factorize(pd.Series(connections), sort=True)
+        connection_codes = np.where(connection_codes < 0, len(connection_uniques) + list_ids, connection_codes)
+        sub_connection_codes, sub_connection_uniques = pd.factorize(pd.Series(sub_connections), sort=True)
+        sub_connection_codes = np.where(
+            sub_connection_codes < 0, len(sub_connection_uniques) + list_ids, sub_connection_codes
+        )
+
+        # Sort the lists so that every level's entities are contiguous per segment
+        self.order = np.lexsort((list_ids, sub_connection_codes, connection_codes, canton_codes))
+        keys = [canton_codes[self.order], connection_codes[self.order], sub_connection_codes[self.order]]
+        connection_starts = _group_starts(keys[:2])
+        sub_connection_starts = _group_starts(keys)
+        self._connection_starts = connection_starts
+        self._sub_connection_starts = sub_connection_starts
+
+        self._connections = _Level(keys[0][connection_starts], len(self.cantons))
+        self._sub_connections = _Level(
+            np.searchsorted(connection_starts, sub_connection_starts, side='right') - 1, len(connection_starts)
+        )
+        self._lists = _Level(
+            np.searchsorted(sub_connection_starts, np.arange(n_lists), side='right') - 1, len(sub_connection_starts)
+        )
+        self.seats = np.array([seats_per_canton.get(canton, 0) for canton in self.cantons], dtype=np.int64)
+
+    @classmethod
+    def from_lists(
+            cls,
+            lists_df: pd.DataFrame,
+            seats_per_canton: Mapping[int, int],
+            method: str = DHONDT,
+    ) -> SeatAllocator:
+        """Compile the allocation of a lists table (as in the BFS lists CSV)."""
+        return cls(
+            lists_df[CANTON_COLUMN].to_numpy(),
+            lists_df[LIST_CONNECTION_COLUMN].to_numpy(),
+            lists_df[LIST_SUB_CONNECTION_COLUMN].to_numpy(),
+            seats_per_canton,
+            method,
+        )
+
+    def allocate(self, votes: np.ndarray) -> np.ndarray:
+        """
+        Allocate the seats of all cantons.
+
+        Args:
+            votes: Votes of every list of shape ``(..., n_lists)``, e.g. one row per scenario
+
+        Returns:
+            Seats of every list, of the shape of the votes
+        """
+        votes = np.asarray(votes, dtype=np.float64)
+        sorted_votes = votes[..., self.order]
+        sub_connection_votes = np.add.reduceat(sorted_votes, self._sub_connection_starts, axis=-1) \
+            if sorted_votes.shape[-1] else sorted_votes
+        connection_votes = np.add.reduceat(sorted_votes, self._connection_starts, axis=-1) \
+            if sorted_votes.shape[-1] else sorted_votes
+
+        connection_seats = self._connections.allocate(connection_votes, self.seats, self.method)
+        sub_connection_seats = self._sub_connections.allocate(sub_connection_votes, connection_seats, self.method)
+        list_seats = self._lists.allocate(sorted_votes, sub_connection_seats, self.method)
+
+        seats = np.empty_like(list_seats)
+        seats[..., self.order] = list_seats
+        return seats
+
+
+def allocate_list_seats(
+        lists_df: pd.DataFrame,
+        seats_per_canton: Mapping[int, int],
+        votes_col: str = LIST_VOTES_COLUMN,
+        method: str = DHONDT,
+) -> pd.Series:
+    """
+    Allocate the seats of all cantons to the lists, see `SeatAllocator`.
+
+    Args:
+        lists_df: The lists (as in the BFS lists CSV) of a single election
+        seats_per_canton: Seats per canton, e.g. `NATIONAL_COUNCIL_SEATS_2019`
+        votes_col: The column with the votes of every list
+        method: The divisor method, see `ALLOCATION_METHODS`
+
+    Returns:
+        Seats of every list (with the index of `lists_df`)
+    """
+    allocator = SeatAllocator.from_lists(lists_df, seats_per_canton, method)
+    return pd.Series(allocator.allocate(lists_df[votes_col].to_numpy(np.float64, na_value=0.0)), index=lists_df.index, name='seats')
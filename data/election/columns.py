@@ -0,0 +1,41 @@
+import numpy as np
+
+from data.attribute import YEAR_ATTR
+
+# Columns of the BFS National Council election CSVs (participation, results and lists)
+YEAR_COLUMN = 'wahl_jahr'
+CANTON_COLUMN = 'kanton_nummer'
+CANTON_NAME_COLUMN = 'kanton_bezeichnung'
+COMMUNE_COLUMN = 'gemeinde_nummer'
+PARTY_COLUMN = 'partei_id'
+PARTY_NAME_COLUMN = 'partei_bezeichnung_de'
+LIST_NUMBER_COLUMN = 'liste_nummer_bfs'
+LIST_NAME_COLUMN = 'liste_bezeichnung'
+ELECTORATE_COLUMN = 'wahlberechtigte'
+BALLOTS_COLUMN = 'gueltige_wahlzettel'
+PARTY_VOTES_COLUMN = 'stimmen_partei'
+LIST_VOTES_COLUMN = 'stimmen_liste'
+LIST_CONNECTION_COLUMN = 'liste_verbindung'
+LIST_SUB_CONNECTION_COLUMN = 'liste_unterlistenverbindung'
+ELECTED_COLUMN = 'anzahl_gewaehlte'
+
+# Declared types of the columns: ids as small integers (to index lookup arrays directly, party ids are
+# nullable as lists and results can be without party), names and list codes as categoricals and counts as
+# nullable integers (other columns are inferred)
+ELECTION_COLUMN_TYPES = {
+    YEAR_COLUMN: YEAR_ATTR.type,
+    CANTON_COLUMN: np.int8,
+    CANTON_NAME_COLUMN: 'category',
+    COMMUNE_COLUMN: np.int16,
+    PARTY_COLUMN: 'Int16',
+    PARTY_NAME_COLUMN: 'category',
+    LIST_NUMBER_COLUMN: 'category',
+    LIST_NAME_COLUMN: 'category',
+    ELECTORATE_COLUMN: 'Int32',
+    BALLOTS_COLUMN: 'Int32',
+    PARTY_VOTES_COLUMN: 'Int32',
+    LIST_VOTES_COLUMN: 'Int32',
+    LIST_CONNECTION_COLUMN: 'category',
+    LIST_SUB_CONNECTION_COLUMN: 'category',
+    ELECTED_COLUMN: 'Int8',
+}
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Hashable, Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+from data.election.allocation import DHONDT, SeatAllocator
+from data.election.columns import PARTY_COLUMN
+from data.election.structure import ElectionStructure
+from data.parallel import default_processes, mapped_pool, worker_state
+
+# Bounds of the drawn turnout rates, the Beta distribution needs both shape parameters positive
+_MIN_TURNOUT = 1e-6
+
+
+def draw_party_votes(
+        rng: np.random.Generator,
+        shares: np.ndarray,
+        turnout: np.ndarray,
+        electorate: np.ndarray,
+        votes_per_ballot: np.ndarray,
+        turnout_concentration: float = None,
+        preference_concentration: float = None,
+) -> np.ndarray:
+    """
+    Draw the party votes of every commune for one scenario.
+
+    The turnout rate of every commune is drawn from a Beta distribution around the expected turnout
+    and the party preferences from a Dirichlet distribution around the expected shares (the higher
+    the concentration, the closer to the expectation, without concentration the expectation is used
+    as is). The ballots are drawn from a binomial distribution of the electorate and split to the
+    parties with a multinomial draw, each ballot counts as `votes_per_ballot` party votes.
+
+    Args:
+        rng: The random generator
+        shares: Expected party shares of shape ``(n_communes, n_parties)``
+        turnout: Expected turnout rate of every commune
+        electorate: Electorate of every commune
+        votes_per_ballot: Party votes per ballot of every commune
+        turnout_concentration: Concentration of the turnout rates
+        preference_concentration: Concentration of the party preferences
+
+    Returns:
+        Party votes of shape ``(n_communes, n_parties)``
+    """
+    if turnout_concentration is not None:
+        turnout = np.clip(turnout, _MIN_TURNOUT, 1 - _MIN_TURNOUT)
+        turnout = rng.beta(turnout_concentration * turnout, turnout_concentration * (1 - turnout))
+    if preference_concentration is not None:
+        # Dirichlet draws from Gamma draws, parties without share stay without votes
+        shares = rng.standard_gamma(preference_concentration * shares)
+    totals = shares.sum(axis=1, keepdims=True)
+    has_voters = totals[:, 0] > 0
+    shares = np.where(has_voters[:, None], shares / np.where(has_voters, totals[:, 0], 1.0)[:, None], 0.0)
+    ballots = np.where(has_voters, rng.binomial(np.round(electorate).astype(np.int64), np.clip(turnout, 0, 1)), 0)
+    return rng.multinomial(ballots, shares) * votes_per_ballot[:, None]
+
+
+def _commune_preferences(
+        structure: ElectionStructure,
+        preferences: np.ndarray | pd.DataFrame = None,
+) -> np.ndarray:
+    """Expected party shares of every commune, from commune-level shares or shares per canton (rows) and party (columns)."""
+    if preferences is None:
+        return structure.party_shares()
+    if isinstance(preferences, pd.DataFrame):
+        preferences = preferences.reindex(index=structure.commune_cantons, columns=structure.parties).to_numpy(
+            np.float64, na_value=0.0
+        )
+    preferences = np.nan_to_num(np.broadcast_to(np.asarray(preferences, dtype=np.float64),
+                                                (structure.n_communes, structure.n_parties)))
+    totals = preferences.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(totals > 0, preferences / totals, 0.0)
+
+
+@dataclass(frozen=True)
+class SimulationResult:
+    """List votes and seats of every simulated scenario, of shape ``(n_scenarios, n_lists)``."""
+    lists: pd.DataFrame
+    votes: np.ndarray
+    seats: np.ndarray
+
+    @property
+    def n_scenarios(self) -> int:
+        return self.seats.shape[0]
+
+    def party_seats(self, by: Hashable = PARTY_COLUMN) -> pd.DataFrame:
+        """Seats of every party (or other list column) in every scenario, with one row per scenario."""
+        codes, parties = pd.factorize(self.lists[by], sort=True)
+        is_known = codes >= 0
+        keys = (np.arange(self.n_scenarios)[:, None] * len(parties) + codes[is_known]).ravel()
+        seats = np.bincount(keys, weights=self.seats[:, is_known].ravel(), minlength=self.n_scenarios * len(parties))
+        return pd.DataFrame(
+            seats.reshape(self.n_scenarios, len(parties)).astype(np.int64),
+            columns=pd.Index(parties, name=by),
+        )
+
+    def summary(self, by: Hashable = PARTY_COLUMN, quantiles: Sequence[float] = (0.05, 0.5, 0.95)) -> pd.DataFrame:
+        """Mean, standard deviation and quantiles of the seats of every party (or other list column)."""
+        party_seats = self.party_seats(by)
+        summary = pd.DataFrame({'Mean': party_seats.mean(), 'Std': party_seats.std()})
+        for quantile in quantiles:
+            summary[f'Q{quantile:g}'] = party_seats.quantile(quantile)
+        return summary.sort_values('Mean', ascending=False)
+
+
+def _simulate_batch(scenarios: range) -> tuple[np.ndarray, np.ndarray]:
+    """List votes and seats of a batch of scenarios, every scenario with its own seed."""
+    state = worker_state
+    party_votes = np.empty((len(scenarios),) + state['shares'].shape)
+    for i, scenario in enumerate(scenarios):
+        party_votes[i] = draw_party_votes(
+            np.random.default_rng([state['seed'], scenario]),
+            state['shares'], state['turnout'], state['electorate'], state['votes_per_ballot'],
+            turnout_concentration=state['turnout_concentration'],
+            preference_concentration=state['preference_concentration'],
+        )
+    list_votes = state['structure'].list_votes(party_votes)
+    return list_votes, state['allocator'].allocate(list_votes)
+
+
+def simulate_elections(
+        structure: ElectionStructure,
+        seats_per_canton: Mapping[int, int],
+        n_scenarios: int = 1000,
+        turnout: np.ndarray = None,
+        preferences: np.ndarray | pd.DataFrame = None,
+        turnout_concentration: float | None = 200.0,
+        preference_concentration: float | None = 1000.0,
+        method: str = DHONDT,
+        seed: int = 0,
+        max_batch_bytes: int = 2 ** 28,
+        processes: int = None,
+) -> SimulationResult:
+    """
+    Monte Carlo simulation of the seats under uncertain turnout and party preferences.
+
+    Every scenario draws the party votes of every commune (see `draw_party_votes`), the scenarios of a
+    batch are aggregated to list votes with one sparse product (see `ElectionStructure.list_votes`) and
+    allocated together (see `SeatAllocator`). The batches are simulated in worker processes, with at most
+    `max_batch_bytes` of commune votes per batch, and every scenario has its own seed (derived from `seed`
+    and the scenario number), so the results do not depend on the batches or processes.
+
+    Args:
+        structure: The election, see `ElectionStructure.from_frames`
+        seats_per_canton: Seats per canton, e.g. `NATIONAL_COUNCIL_SEATS_2019`
+        n_scenarios: Number of scenarios
+        turnout: Expected turnout rate of every commune (default: the observed turnout)
+        preferences: Expected party preferences of shape ``(n_communes, n_parties)`` or a DataFrame
+            with cantons as rows and parties as columns, e.g. weighted Selects party shares
+            (default: the observed party shares)
+        turnout_concentration: Concentration of the turnout rates around the expectation
+            (None to only draw the ballots)
+        preference_concentration: Concentration of the party preferences around the expectation
+            (None to only draw the ballots)
+        method: The divisor method, see `ALLOCATION_METHODS`
+        seed: Seed of the simulation
+        max_batch_bytes: Maximum memory of the commune votes of a batch
+        processes: Number of worker processes (default: all but one CPU)
+
+    Returns:
+        The list votes and seats of every scenario
+    """
+    allocator = SeatAllocator.from_lists(structure.lists, seats_per_canton, method)
+    arrays = {
+        'shares': _commune_preferences(structure, preferences),
+        'turnout': structure.turnout if turnout is None else np.broadcast_to(
+            np.asarray(turnout, dtype=np.float64), (structure.n_communes,)
+        ),
+        'electorate': structure.electorate,
+        'votes_per_ballot': structure.votes_per_ballot,
+    }
+    state = {
+        'structure': structure,
+        'allocator': allocator,
+        'turnout_concentration': turnout_concentration,
+        'preference_concentration': preference_concentration,
+        'seed': seed,
+    }
+
+    processes = processes or default_processes()
+    # Commune votes and the drawn preferences of every scenario of a batch
+    scenario_bytes = 2 * structure.n_communes * structure.n_parties * np.dtype(np.float64).itemsize
+    batch_size = max(1, min(max_batch_bytes // scenario_bytes, -(-n_scenarios // processes)))
+    batches = [range(start, min(start + batch_size, n_scenarios)) for start in range(0, n_scenarios, batch_size)]
+    with mapped_pool(arrays, state, processes) as pool:
+        results = pool.map(_simulate_batch, batches)
+
+    n_lists = len(structure.lists)
+    return SimulationResult(
+        lists=structure.lists,
+        votes=np.concatenate([votes for votes, _ in results]) if results else np.zeros((0, n_lists)),
+        seats=np.concatenate([seats for _, seats in results]) if results else np.zeros((0, n_lists), dtype=np.int64),
+    )
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from data.cache import ELECTION_CACHE, memoize
+from data.election.columns import (
+    ELECTION_COLUMN_TYPES, YEAR_COLUMN, CANTON_COLUMN, COMMUNE_COLUMN, PARTY_COLUMN, LIST_NUMBER_COLUMN
+)
+
+PARTICIPATION_FILE = 'data_raw/bfs_national_council_election_participation_2019.csv'
+RESULTS_FILE = 'data_raw/bfs_national_council_election_results_2019.csv'
+LISTS_FILE = 'data_raw/bfs_national_council_election_lists_2019.csv'
+
+
+# Sort order of the tables, for the indexed views of `Election`
+PARTICIPATION_ORDER = [YEAR_COLUMN, CANTON_COLUMN, COMMUNE_COLUMN]
+RESULTS_ORDER = [YEAR_COLUMN, CANTON_COLUMN, COMMUNE_COLUMN, PARTY_COLUMN]
+LISTS_ORDER = [YEAR_COLUMN, CANTON_COLUMN, PARTY_COLUMN, LIST_NUMBER_COLUMN]
+
+
+def _read_election_csv(path: str, sort_columns: list[str]) -> pd.DataFrame:
+    """Read a BFS election CSV with the declared column types, sorted for the indexed views."""
+    df = pd.read_csv(path, sep=';', dtype=ELECTION_COLUMN_TYPES)
+    return df.sort_values(sort_columns, kind='stable', ignore_index=True)
+
+
+@memoize(ELECTION_CACHE, sources=(PARTICIPATION_FILE,))
+def load_election_participation() -> pd.DataFrame:
+    """Electorate and valid ballots of every commune, sorted by year, canton and commune."""
+    return _read_election_csv(PARTICIPATION_FILE, PARTICIPATION_ORDER)
+
+
+@memoize(ELECTION_CACHE, sources=(RESULTS_FILE,))
+def load_election_results() -> pd.DataFrame:
+    """Party votes of every commune, sorted by year, canton, commune and party."""
+    return _read_election_csv(RESULTS_FILE, RESULTS_ORDER)
+
+
+@memoize(ELECTION_CACHE, sources=(LISTS_FILE,))
+def load_election_lists() -> pd.DataFrame:
+    """Votes, connections and elected candidates of every list, sorted by year, canton, party and list."""
+    return _read_election_csv(LISTS_FILE, LISTS_ORDER)
+
+
+def _year_rows(df: pd.DataFrame, year: int) -> pd.DataFrame:
+    """The rows of a year of a table sorted by year, as a slice (without copying)."""
+    years = df[YEAR_COLUMN].to_numpy()
+    return df.iloc[np.searchsorted(years, year, side='left'):np.searchsorted(years, year, side='right')]
+
+
+def _canton_party_keys(cantons: np.ndarray | pd.Series, parties: np.ndarray | pd.Series) -> np.ndarray:
+    """Key of (canton, party) pairs in the order of the sorted lists (lists without party last in their canton)."""
+    n_parties = np.iinfo(np.int16).max + 1
+    parties = pd.array(parties, dtype=ELECTION_COLUMN_TYPES[PARTY_COLUMN]).to_numpy(np.int64, na_value=n_parties - 1)
+    return np.asarray(cantons, dtype=np.int64) * n_parties + parties
+
+
+@dataclass(frozen=True)
+class Election:
+    """
+    The participation, results and lists of a single election, sorted so that joins are array lookups.
+
+    The participation has one row per commune (by canton and commune), the results one row per commune
+    and party (in the same commune order) and the lists are sorted by canton and party.
+    """
+    year: int
+    participation: pd.DataFrame
+    results: pd.DataFrame
+    lists: pd.DataFrame
+
+    @classmethod
+    def from_frames(cls, participation: pd.DataFrame, results: pd.DataFrame, lists: pd.DataFrame) -> Election:
+        """
+        The election of tables as in the BFS CSVs (e.g. modified copies of the tables of `get_election`),
+        sorted like the loaded tables. The tables keep their index, so rows can be mapped back.
+        """
+        years = pd.unique(pd.concat([participation[YEAR_COLUMN], results[YEAR_COLUMN], lists[YEAR_COLUMN]]))
+        if len(years) != 1:
+            raise ValueError(f'Expected the tables of a single election, got the years {list(years)}')
+        return cls(
+            year=int(years[0]),
+            participation=participation.sort_values(PARTICIPATION_ORDER, kind='stable'),
+            results=results.sort_values(RESULTS_ORDER, kind='stable'),
+            lists=lists.sort_values(LISTS_ORDER, kind='stable'),
+        )
+
+    @cached_property
+    def _commune_lookup(self) -> np.ndarray:
+        """Participation row of every commune number, -1 for unknown communes."""
+        communes = self.participation[COMMUNE_COLUMN].to_numpy(np.int64)
+        lookup = np.full(communes.max(initial=-1) + 1, -1, dtype=np.int64)
+        lookup[communes] = np.arange(len(communes))
+        return lookup
+
+    @cached_property
+    def _list_keys(self) -> np.ndarray:
+        """Sorted (canton, party) key of every list."""
+        return _canton_party_keys(self.lists[CANTON_COLUMN], self.lists[PARTY_COLUMN])
+
+    def commune_rows(self, communes: np.ndarray | pd.Series) -> np.ndarray:
+        """Participation row of every commune number (-1 for unknown communes)."""
+        codes = np.asarray(communes, dtype=np.int64)
+        lookup = self._commune_lookup
+        is_known = (codes >= 0) & (codes < len(lookup))
+        return np.where(is_known, lookup[np.where(is_known, codes, 0)], -1)
+
+    def list_rows(self, cantons: np.ndarray | pd.Series, parties: np.ndarray | pd.Series) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Ranges of the lists of parties in cantons, by binary search in the sorted lists.
+
+        Returns:
+            The first list row and the row after the last list of every (canton, party) pair
+        """
+        keys = _canton_party_keys(cantons, parties)
+        return (
+            np.searchsorted(self._list_keys, keys, side='left'),
+            np.searchsorted(self._list_keys, keys, side='right'),
+        )
+
+
+@memoize(ELECTION_CACHE, dependencies=(load_election_participation, load_election_results, load_election_lists),
+         disk=False)
+def get_election(year: int) -> Election:
+    """The participation, results and lists of an election year, see `Election`."""
+    return Election(
+        year=year,
+        participation=_year_rows(load_election_participation(), year),
+        results=_year_rows(load_election_results(), year),
+        lists=_year_rows(load_election_lists(), year),
+    )
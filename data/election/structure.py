@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from data.election.columns import (
+    ELECTION_COLUMN_TYPES, CANTON_COLUMN, COMMUNE_COLUMN, PARTY_COLUMN, ELECTORATE_COLUMN, BALLOTS_COLUMN,
+    PARTY_VOTES_COLUMN, LIST_VOTES_COLUMN
+)
+from data.election.source import Election
+
+
+def _list_matrix(election: Election, commune_cantons: np.ndarray, parties: np.ndarray) -> sparse.csr_matrix:
+    """
+    Sparse matrix of shape ``(n_communes * n_parties, n_lists)`` that distributes the votes of every
+    party in every commune to the lists of the party in the commune's canton (of `election`), by their
+    share of the party's list votes in the canton.
+    """
+    n_communes, n_parties = len(commune_cantons), len(parties)
+    # The lists of every party in every commune's canton are a range of the sorted lists
+    starts, ends = election.list_rows(np.repeat(commune_cantons, n_parties), np.tile(parties, n_communes))
+    counts = ends - starts
+    list_votes = election.lists[LIST_VOTES_COLUMN].to_numpy(np.float64, na_value=0.0)
+    cumulative_votes = np.concatenate(([0.0], np.cumsum(list_votes)))
+    totals = (cumulative_votes[ends] - cumulative_votes[starts]).repeat(counts)
+
+    rows = np.repeat(np.arange(n_communes * n_parties), counts)
+    lists = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts) + starts.repeat(counts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(totals > 0, list_votes[lists] / totals, 0.0)
+    matrix = sparse.csr_matrix((shares, (rows, lists)), shape=(n_communes * n_parties, len(list_votes)))
+    matrix.eliminate_zeros()
+    return matrix
+
+
+@dataclass(frozen=True)
+class ElectionStructure:
+    """
+    The commune-level votes of an election and how they flow to the lists of the seat allocation.
+
+    Party votes of shape ``(..., n_communes, n_parties)`` (e.g. one per scenario) become list votes of
+    shape ``(..., n_lists)`` with one sparse product, see `list_votes`: the votes of a party in a
+    commune go to the party's lists in the commune's canton, by the lists' share of the party's votes.
+    """
+    communes: pd.MultiIndex  # (canton, commune) of every commune, sorted
+    parties: pd.Index
+    lists: pd.DataFrame  # The lists of the seat allocation, see `SeatAllocator.from_lists`
+    electorate: np.ndarray
+    ballots: np.ndarray
+    party_votes: np.ndarray
+    list_matrix: sparse.csr_matrix
+
+    @property
+    def n_communes(self) -> int:
+        return len(self.communes)
+
+    @property
+    def n_parties(self) -> int:
+        return len(self.parties)
+
+    @property
+    def commune_cantons(self) -> np.ndarray:
+        """Canton of every commune."""
+        return self.communes.get_level_values(0).to_numpy()
+
+    @property
+    def turnout(self) -> np.ndarray:
+        """Share of the electorate with a valid ballot in every commune (zero without electorate)."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.electorate > 0, self.ballots / self.electorate, 0.0)
+
+    @property
+    def votes_per_ballot(self) -> np.ndarray:
+        """Party votes per valid ballot in every commune (the canton's seats, less empty lines)."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.ballots > 0, self.party_votes.sum(axis=1) / self.ballots, 0.0)
+
+    def party_shares(self) -> np.ndarray:
+        """Share of every party in the party votes of every commune, of shape ``(n_communes, n_parties)``."""
+        totals = self.party_votes.sum(axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(totals > 0, self.party_votes / totals, 0.0)
+
+    @cached_property
+    def commune_list_matrix(self) -> sparse.csr_matrix:
+        """
+        Sparse matrix of shape ``(n_communes, n_lists)`` with the observed votes of every commune that go to
+        every list, so list votes under per-commune vote multipliers are one product.
+        """
+        communes = np.repeat(np.arange(self.n_communes), self.n_parties)
+        party_votes = sparse.csr_matrix(
+            (self.party_votes.ravel(), (communes, np.arange(self.n_communes * self.n_parties))),
+            shape=(self.n_communes, self.n_communes * self.n_parties),
+        )
+        return (party_votes @ self.list_matrix).tocsr()
+
+    def list_votes(self, party_votes: np.ndarray) -> np.ndarray:
+        """
+        Votes of every list from party votes per commune.
+
+        Args:
+            party_votes: Votes of shape ``(..., n_communes, n_parties)``
+
+        Returns:
+            Votes of shape ``(..., n_lists)``
+        """
+        party_votes = np.asarray(party_votes, dtype=np.float64)
+        flat = party_votes.reshape(-1, self.n_communes * self.n_parties)
+        return (self.list_matrix.T @ flat.T).T.reshape(party_votes.shape[:-2] + (len(self.lists),))
+
+    @classmethod
+    def from_election(cls, election: Election) -> ElectionStructure:
+        """
+        Compile the structure of a single election, with array lookups in its sorted tables (see `Election`).
+
+        Communes without electorate or valid ballots and results of unknown communes are left out,
+        lists of parties without results get no votes. The lists are in the order of ``election.lists``.
+        """
+        participation = election.participation
+        has_ballots = (participation[ELECTORATE_COLUMN].notna() & participation[BALLOTS_COLUMN].notna()).to_numpy()
+        commune_cantons = participation[CANTON_COLUMN].to_numpy(np.int64)
+        # Position of every participation row among the kept communes, with a trailing -1 for unknown communes
+        commune_positions = np.append(np.where(has_ballots, np.cumsum(has_ballots) - 1, -1), -1)
+
+        results = election.results
+        result_parties = results[PARTY_COLUMN].to_numpy(np.int64, na_value=-1)
+        parties = np.unique(np.concatenate((
+            result_parties, election.lists[PARTY_COLUMN].to_numpy(np.int64, na_value=-1)
+        )))
+        parties = parties[parties >= 0]
+        result_rows = election.commune_rows(results[COMMUNE_COLUMN])
+        # Results in another canton than their commune are of unknown communes (as for a merge on both)
+        result_rows[commune_cantons[result_rows] != results[CANTON_COLUMN].to_numpy(np.int64)] = -1
+        result_communes = commune_positions[result_rows]
+        is_known = (result_communes >= 0) & (result_parties >= 0)
+        n_communes = int(has_ballots.sum())
+        party_votes = np.bincount(
+            result_communes[is_known] * len(parties) + np.searchsorted(parties, result_parties[is_known]),
+            weights=results[PARTY_VOTES_COLUMN].to_numpy(np.float64, na_value=0.0)[is_known],
+            minlength=n_communes * len(parties),
+        ).reshape(n_communes, len(parties))
+
+        kept = participation[has_ballots]
+        return cls(
+            communes=pd.MultiIndex.from_frame(kept[[CANTON_COLUMN, COMMUNE_COLUMN]]),
+            parties=pd.Index(pd.array(parties, dtype=ELECTION_COLUMN_TYPES[PARTY_COLUMN]), name=PARTY_COLUMN),
+            lists=election.lists,
+            electorate=kept[ELECTORATE_COLUMN].to_numpy(np.float64),
+            ballots=kept[BALLOTS_COLUMN].to_numpy(np.float64),
+            party_votes=party_votes,
+            list_matrix=_list_matrix(election, commune_cantons[has_ballots], parties),
+        )
+
+    @classmethod
+    def from_frames(
+            cls,
+            participation_df: pd.DataFrame,
+            results_df: pd.DataFrame,
+            lists_df: pd.DataFrame,
+    ) -> ElectionStructure:
+        """
+        Compile the structure of a single election from the BFS participation, results and lists tables,
+        see `from_election`. The lists keep their order (with a default index).
+        """
+        lists_df = lists_df.reset_index(drop=True)
+        structure = cls.from_election(Election.from_frames(participation_df, results_df, lists_df))
+        # Back from the sorted lists to the given order
+        list_order = np.argsort(structure.lists.index.to_numpy())
+        return replace(structure, lists=lists_df, list_matrix=structure.list_matrix[:, list_order].tocsr())
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from typing import Mapping
+
+import numpy as np
+
+from data.election.allocation import DHONDT, SeatAllocator
+from data.election.structure import ElectionStructure
+
+
+def full_turnout_multipliers(structure: ElectionStructure) -> np.ndarray:
+    """
+    Vote multipliers of every commune if the whole electorate voted like the commune's voters
+    (zero for communes without valid ballots).
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(structure.ballots > 0, structure.electorate / structure.ballots, 0.0)
+
+
+def target_turnout_multipliers(structure: ElectionStructure, turnout: np.ndarray) -> np.ndarray:
+    """
+    Vote multipliers of every commune for target turnout rates, with the voters of every commune voting
+    like its observed voters.
+
+    Args:
+        structure: The election
+        turnout: Target turnout rates of shape ``(..., n_communes)``, e.g. from per-demographic turnout rates
+            (of weighted Selects participation) applied to the electorate of every commune
+
+    Returns:
+        Multipliers of the shape of `turnout` (zero for communes without valid ballots)
+    """
+    observed = structure.turnout
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(observed > 0, np.asarray(turnout, dtype=np.float64) / observed, 0.0)
+
+
+def counterfactual_list_votes(
+        structure: ElectionStructure,
+        multipliers: np.ndarray,
+        round_communes: bool = False,
+) -> np.ndarray:
+    """
+    List votes with the votes of every commune scaled by a turnout multiplier.
+
+    The scaled votes of every party in a commune go to the party's lists in the commune's canton by the
+    lists' share of the party's observed list votes, as one sparse product for all scenarios (see
+    `ElectionStructure.commune_list_matrix`).
+
+    Args:
+        structure: The election
+        multipliers: Multipliers of shape ``(n_communes,)`` or ``(n_scenarios, n_communes)``,
+            see `full_turnout_multipliers` and `target_turnout_multipliers`
+        round_communes: Whether to round the scaled votes of every party in every commune to whole votes
+            before distributing them to the lists (as the notebook's turnout simulation did), this
+            materializes the party votes of every scenario (see `ElectionStructure.list_votes`)
+
+    Returns:
+        List votes of shape ``(n_lists,)`` or ``(n_scenarios, n_lists)``
+    """
+    multipliers = np.asarray(multipliers, dtype=np.float64)
+    if round_communes:
+        return structure.list_votes(np.round(structure.party_votes * multipliers[..., :, None]))
+    flat = multipliers.reshape(-1, structure.n_communes)
+    votes = (structure.commune_list_matrix.T @ flat.T).T
+    return votes.reshape(multipliers.shape[:-1] + (len(structure.lists),))
+
+
+def counterfactual_seats(
+        structure: ElectionStructure,
+        multipliers: np.ndarray,
+        seats_per_canton: Mapping[int, int],
+        method: str = DHONDT,
+        round_communes: bool = False,
+) -> np.ndarray:
+    """
+    Seats of every list with the votes of every commune scaled by a turnout multiplier, see `counterfactual_list_votes`.
+
+    Returns:
+        Seats of shape ``(n_lists,)`` or ``(n_scenarios, n_lists)``
+    """
+    allocator = SeatAllocator.from_lists(structure.lists, seats_per_canton, method)
+    return allocator.allocate(counterfactual_list_votes(structure, multipliers, round_communes))
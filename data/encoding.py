@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+def encode_column(values: pd.Series, sort: bool = False, observed: bool = True) -> tuple[np.ndarray, pd.Index]:
+    """
+    Contiguous integer codes of a column and its unique values.
+
+    Missing values get the extra code ``len(uniques)``, so an array with one trailing entry for
+    missing values (e.g. a neutral factor or a count) can be indexed directly with the codes.
+
+    Args:
+        values: The column
+        sort: Whether the uniques are sorted (categories in their order) instead of in order of appearance
+        observed: Whether categorical columns only have their observed categories as uniques
+            (else all categories, in their order)
+    """
+    if not observed and isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.array.codes.astype(np.intp)
+        uniques = pd.CategoricalIndex(pd.Categorical.from_codes(
+            np.arange(len(values.dtype.categories)), dtype=values.dtype
+        ))
+    else:
+        codes, uniques = pd.factorize(values, sort=sort)
+        codes, uniques = codes.astype(np.intp), pd.Index(uniques)
+    codes[codes < 0] = len(uniques)
+    return codes, uniques.rename(values.name)
+
+
+def with_missing(uniques: pd.Index) -> pd.Index:
+    """The uniques of `encode_column` with the missing value appended, so they can be taken with the codes."""
+    return pd.Index(
+        uniques.array.take(np.append(np.arange(len(uniques)), -1), allow_fill=True), name=uniques.name
+    )
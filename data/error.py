@@ -1,7 +1,6 @@
 import numpy as np
 import pandas as pd
 from scipy import stats
-import statsmodels.api as sm
 
 
 def kish_effective_sample_size(weights: pd.Series, clusters: pd.Series = None) -> float:
@@ -93,7 +92,12 @@ def finite_classical_error_margin(
 def _robust_standard_error(
         metric: pd.Series, weights: pd.Series, clusters: pd.Series = None
 ) -> float:
-    """ Calculate robust or cluster-robust standard error for a 0/1 metric using WLS."""
+    """
+    Calculate robust (HC1) or cluster-robust standard error for a 0/1 metric.
+
+    Closed form of the intercept-only WLS fit with statsmodels' ``get_robustcov_results``
+    (``cov_type='HC1'`` or ``'cluster'`` with its small sample correction).
+    """
     if weights.sum() == 0:
         return np.nan
     if len(metric) != len(weights):
@@ -102,25 +106,32 @@ def _robust_standard_error(
         raise ValueError(f"Length mismatch: metric {len(metric)} and clusters {len(clusters)}")
 
     # Drop any NaNs by removing the entry from all series.
-    model_data = {'metric': metric.astype(float), 'weights': weights.astype(float)}
+    metric = metric.astype(float).to_numpy(np.float64, na_value=np.nan)
+    weights = weights.astype(float).to_numpy(np.float64, na_value=np.nan)
+    is_valid = ~np.isnan(metric) & ~np.isnan(weights)
     if clusters is not None:
-        model_data['clusters'] = clusters
-    model_df = pd.DataFrame(model_data).dropna()
-    if model_df['weights'].sum() == 0:
+        clusters = clusters.to_numpy()
+        is_valid &= ~pd.isna(clusters)
+    metric, weights = metric[is_valid], weights[is_valid]
+    weights_sum = weights.sum()
+    if weights_sum == 0:
         return np.nan
-
-    x = pd.DataFrame({'intercept': np.ones(len(model_df))}, index=model_df.index)
-    wls = sm.WLS(model_df['metric'], x, weights=model_df['weights'])
-    res = wls.fit()
-    if res.df_resid <= 0:
+    sample_size = len(metric)
+    if sample_size - 1 <= 0:
         return np.nan
-    robust_res = (
-        res.get_robustcov_results(cov_type='HC1')
-        if clusters is None else
-        res.get_robustcov_results(cov_type='cluster', groups=model_df['clusters'])
-    )
-    return robust_res.bse[0] if isinstance(robust_res.bse, (np.ndarray, list)) else \
-        robust_res.bse.get('intercept', np.nan)
+
+    # Score of every observation: weight times residual from the weighted mean
+    scores = weights * (metric - (weights * metric).sum() / weights_sum)
+    if clusters is None:
+        meat = (scores ** 2).sum()
+        correction = sample_size / (sample_size - 1)
+    else:
+        codes, uniques = pd.factorize(clusters[is_valid])
+        if len(uniques) <= 1:
+            return np.nan
+        meat = (np.bincount(codes, weights=scores, minlength=len(uniques)) ** 2).sum()
+        correction = len(uniques) / (len(uniques) - 1)
+    return np.sqrt(correction * meat) / weights_sum
 
 
 def infinite_weighted_error_margin(
@@ -159,3 +170,180 @@ def finite_weighted_error_margin(
 def propagate_error_for_weighted_mean(weights: pd.Series, error_margins: pd.Series) -> float:
     """ Calculate the propagated error for a weighted mean. """
     return np.sqrt((((weights / weights.sum()) ** 2) * (error_margins ** 2)).sum())
+
+
+def _group_codes(weights: pd.Series, by) -> tuple[np.ndarray, pd.Index]:
+    """Group code of every observation (-1 for missing keys) and the group keys, as in ``weights.groupby(by)``."""
+    grouped = weights.groupby(by, observed=True)
+    return grouped.ngroup().fillna(-1).to_numpy(np.int64), grouped.size().index
+
+
+def _cluster_cells(group_codes: np.ndarray, clusters: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cell (unique group and cluster) of every observation (-1 if either is missing)
+    and the group of every cell.
+    """
+    cluster_codes, _ = pd.factorize(clusters.to_numpy())
+    is_valid = (group_codes >= 0) & (cluster_codes >= 0)
+    cells = np.full(len(group_codes), -1, dtype=np.int64)
+    cells[is_valid], _ = pd.factorize(group_codes[is_valid] * (cluster_codes.max(initial=-1) + 1) + cluster_codes[is_valid])
+    cell_groups = np.zeros(cells.max(initial=-1) + 1, dtype=np.int64)
+    cell_groups[cells[is_valid]] = group_codes[is_valid]
+    return cells, cell_groups
+
+
+def _grouped_kish_ess(
+        weights: np.ndarray, group_codes: np.ndarray, n_groups: int, clusters: pd.Series = None
+) -> np.ndarray:
+    if clusters is not None:
+        cells, cell_groups = _cluster_cells(group_codes, clusters)
+        is_valid = cells >= 0
+        weights = np.bincount(cells[is_valid], weights=weights[is_valid], minlength=len(cell_groups))
+        group_codes = cell_groups
+    is_valid = group_codes >= 0
+    weights_sum = np.bincount(group_codes[is_valid], weights=weights[is_valid], minlength=n_groups)
+    weights_square = np.bincount(group_codes[is_valid], weights=weights[is_valid] ** 2, minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(weights_square == 0, np.nan, weights_sum ** 2 / weights_square)
+
+
+def grouped_kish_ess(weights: pd.Series, clusters: pd.Series = None, by=None) -> pd.Series:
+    """
+    Kish's effective sample size of every group in one pass, see `kish_effective_sample_size`.
+
+    Args:
+        weights: A pandas Series of weights for each observation.
+        clusters: An optional pandas Series with cluster IDs for each observation.
+        by: Group keys for each observation, anything accepted by ``weights.groupby``.
+
+    Returns:
+        The effective sample size per group.
+    """
+    group_codes, groups = _group_codes(weights, by)
+    ess = _grouped_kish_ess(
+        weights.to_numpy(np.float64, na_value=0.0), group_codes, len(groups), clusters
+    )
+    return pd.Series(ess, index=groups, name='Effective Sample Size')
+
+
+def _finite_population_correction(
+        infinite_moe: np.ndarray, sample_size: np.ndarray, population_size: np.ndarray
+) -> np.ndarray:
+    """Vectorized `finite_population_correction`, NaN for groups without (known) population."""
+    has_population = population_size > 0
+    if np.any(sample_size[has_population] > population_size[has_population]):
+        raise ValueError('Sample size cannot be greater than population size.')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fpc_factor = np.sqrt((population_size - sample_size) / (population_size - 1))
+    corrected = np.where(np.isnan(fpc_factor), infinite_moe, infinite_moe * fpc_factor)
+    corrected = np.where(sample_size == population_size, 0.0, corrected)
+    return np.where(has_population, corrected, np.nan)
+
+
+def grouped_finite_error_margin(
+        weights: pd.Series,
+        population_size: pd.Series,
+        by,
+        clusters: pd.Series = None,
+        confidence=0.95,
+        population_proportion=0.5,
+) -> pd.DataFrame:
+    """
+    Classical margin of error of every group in one pass, from the effective sample size of the group
+    and its population size (see `finite_classical_error_margin`).
+
+    Args:
+        weights: A pandas Series of weights for each observation.
+        population_size: Population size per group (keyed like the groups).
+        by: Group keys for each observation, anything accepted by ``weights.groupby``.
+        clusters: An optional pandas Series with cluster IDs for each observation.
+        confidence: Confidence level of the margin.
+        population_proportion: Assumed proportion.
+
+    Returns:
+        DataFrame with the effective sample size, population size and error margin per group
+        (NaN for groups without population).
+    """
+    if not (0 < confidence < 1 and 0 <= population_proportion <= 1):
+        raise ValueError("Invalid confidence or proportion.")
+    ess = grouped_kish_ess(weights, clusters, by)
+    population = population_size.reindex(ess.index).to_numpy(np.float64, na_value=np.nan)
+    zscore_confidence = stats.norm.ppf((1 + confidence) / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        infinite_moe = np.where(
+            ess > 0,
+            zscore_confidence * np.sqrt(population_proportion * (1 - population_proportion) / ess.to_numpy()),
+            np.nan
+        )
+    return pd.DataFrame({
+        'Effective Sample Size': ess,
+        'Population': population,
+        'Error Margin': _finite_population_correction(infinite_moe, ess.to_numpy(), population),
+    }, index=ess.index)
+
+
+def grouped_weighted_error_margin(
+        metric: pd.Series,
+        weights: pd.Series,
+        by,
+        clusters: pd.Series = None,
+        population_size: pd.Series = None,
+        confidence=0.95,
+) -> pd.DataFrame:
+    """
+    Weighted mean of a 0/1 metric and its (cluster-)robust margin of error for every group in one pass,
+    see `infinite_weighted_error_margin` and `finite_weighted_error_margin` (if `population_size` is given).
+
+    Args:
+        metric: The 0/1 metric for each observation.
+        weights: A pandas Series of weights for each observation.
+        by: Group keys for each observation, anything accepted by ``weights.groupby``.
+        clusters: An optional pandas Series with cluster IDs for each observation.
+        population_size: Optional population size per group (keyed like the groups).
+        confidence: Confidence level of the margin.
+
+    Returns:
+        DataFrame with the weighted mean ('Value') and the margin of error ('Error') per group.
+    """
+    if not 0 < confidence < 1:
+        raise ValueError("Invalid confidence.")
+    if len(metric) != len(weights):
+        raise ValueError(f"Length mismatch: metric {len(metric)} and weights {len(weights)}")
+    if clusters is not None and len(clusters) != len(metric):
+        raise ValueError(f"Length mismatch: metric {len(metric)} and clusters {len(clusters)}")
+    group_codes, groups = _group_codes(weights, by)
+    n_groups = len(groups)
+
+    # Drop any NaNs from the estimation (as in `_robust_standard_error`)
+    metric_values = metric.astype(float).to_numpy(np.float64, na_value=np.nan)
+    weight_values = weights.astype(float).to_numpy(np.float64, na_value=np.nan)
+    is_valid = (group_codes >= 0) & ~np.isnan(metric_values) & ~np.isnan(weight_values)
+    if clusters is not None:
+        is_valid &= ~pd.isna(clusters.to_numpy())
+    valid_codes = group_codes[is_valid]
+    metric_values, weight_values = metric_values[is_valid], weight_values[is_valid]
+    weights_sum = np.bincount(valid_codes, weights=weight_values, minlength=n_groups)
+    sample_size = np.bincount(valid_codes, minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(valid_codes, weights=weight_values * metric_values, minlength=n_groups) / weights_sum
+
+        # Score of every observation: weight times residual from the weighted mean of its group
+        scores = weight_values * (metric_values - np.nan_to_num(mean)[valid_codes])
+        if clusters is None:
+            meat = np.bincount(valid_codes, weights=scores ** 2, minlength=n_groups)
+            correction = sample_size / (sample_size - 1)
+        else:
+            cells, cell_groups = _cluster_cells(valid_codes, clusters[is_valid])
+            cell_scores = np.bincount(cells, weights=scores, minlength=len(cell_groups))
+            meat = np.bincount(cell_groups, weights=cell_scores ** 2, minlength=n_groups)
+            n_clusters = np.bincount(cell_groups, minlength=n_groups)
+            correction = np.where(n_clusters > 1, n_clusters / (n_clusters - 1), np.nan)
+        standard_error = np.sqrt(correction * meat) / weights_sum
+    standard_error = np.where((weights_sum == 0) | (sample_size - 1 <= 0), np.nan, standard_error)
+    error = stats.norm.ppf((1 + confidence) / 2) * standard_error
+
+    if population_size is not None:
+        ess = _grouped_kish_ess(weights.to_numpy(np.float64, na_value=0.0), group_codes, n_groups, clusters)
+        population = population_size.reindex(groups).to_numpy(np.float64, na_value=np.nan)
+        error = _finite_population_correction(error, ess, population)
+    return pd.DataFrame({'Value': np.where(weights_sum == 0, np.nan, mean), 'Error': error}, index=groups)
@@ -1,10 +1,10 @@
-import functools
 from datetime import datetime
 
 import numpy as np
 import pandas as pd
 
 from data.attribute import Attribute
+from data.cache import LOCATION_CACHE, memoize
 
 # Administrative region codes defined by https://www.agvchapp.bfs.admin.ch/
 # as specified by https://www.ech.ch/de/ech/ech-0071/1.2.0
@@ -17,11 +17,14 @@ COMMUNE_ATTR = Attribute(
     'BFS commune code'
 )
 
+CANTONS_FILE = 'data_raw/bfs_historical_commune_registry/dz-b-00.04-hgv-01/1.2.0/20250406_GDEHist_KT.txt'
+COMMUNES_FILE = 'data_raw/bfs_historical_commune_registry/dz-b-00.04-hgv-01/1.2.0/20250406_GDEHist_GDE.txt'
 
-@functools.cache
+
+@memoize(LOCATION_CACHE, sources=(CANTONS_FILE,))
 def load_cantons_metadata() -> pd.DataFrame:
     return pd.read_csv(
-        'data_raw/bfs_historical_commune_registry/dz-b-00.04-hgv-01/1.2.0/20250406_GDEHist_KT.txt',
+        CANTONS_FILE,
         sep='\t',
         encoding='latin_1',
         names=[
@@ -35,10 +38,10 @@ def load_cantons_metadata() -> pd.DataFrame:
     )
 
 
-@functools.cache
+@memoize(LOCATION_CACHE, sources=(COMMUNES_FILE,))
 def load_communes_metadata() -> pd.DataFrame:
     return pd.read_csv(
-        'data_raw/bfs_historical_commune_registry/dz-b-00.04-hgv-01/1.2.0/20250406_GDEHist_GDE.txt',
+        COMMUNES_FILE,
         sep='\t',
         encoding='latin_1',
         names=[
@@ -67,10 +70,96 @@ def load_communes_metadata() -> pd.DataFrame:
     )
 
 
+# Dates are indexed as days since this date, so a commune and a day fit in one sortable integer key
+_REGISTRY_EPOCH = np.datetime64('1800-01-01', 'D')
+_DAY_BITS = 20
+_NEVER = (1 << _DAY_BITS) - 1
+
+
+def _registry_days(dates, missing: int) -> np.ndarray:
+    """Days since the registry epoch of dates (scalar or array-like), `missing` for missing dates."""
+    dates = np.asarray(pd.to_datetime(dates), dtype='datetime64[D]')
+    days = np.clip((dates - _REGISTRY_EPOCH).astype(np.int64), 0, _NEVER)
+    return np.where(np.isnat(dates), missing, days)
+
+
+class CommuneRegistry:
+    """
+    Interval index over the validity (admission to abolition date) of the records of the historical
+    commune registry, answering which communes were valid on a date and which record a commune was
+    on a date by binary search.
+
+    The valid records only change on admission and abolition dates, so all dates between two such
+    boundaries share one snapshot, which is built on first use and kept.
+    """
+
+    def __init__(self, communes_df: pd.DataFrame):
+        self.df = communes_df
+        # Records without admission date are never valid, as in a plain ``admission date <= date`` filter
+        self.admission_days = _registry_days(communes_df['municipalityAdmissionDate'], missing=_NEVER)
+        self.abolition_days = _registry_days(communes_df['municipalityAbolitionDate'], missing=_NEVER)
+        communes = communes_df[COMMUNE_ATTR].to_numpy(np.int64)
+        # Records by commune and admission, keyed on both
+        self._record_order = np.lexsort((self.abolition_days, self.admission_days, communes))
+        self._record_keys = (communes[self._record_order] << _DAY_BITS) | self.admission_days[self._record_order]
+        self._boundaries = np.unique(np.concatenate((self.admission_days, self.abolition_days)))
+        self._snapshots = {}
+
+    def _segment(self, day: int) -> int:
+        """Position of the boundary interval of a day (-1 before the first boundary)."""
+        return int(np.searchsorted(self._boundaries, day, side='right')) - 1
+
+    def valid_rows(self, date) -> np.ndarray:
+        """Rows (in registry order) of the records valid on a date."""
+        return self._snapshot(date)[0]
+
+    def valid_on(self, date) -> pd.DataFrame:
+        """
+        The records valid on a date (admitted on or before and not abolished on or before the date).
+
+        The snapshot is shared by all dates between the same boundaries and must not be modified.
+        """
+        return self._snapshot(date)[1]
+
+    def _snapshot(self, date) -> tuple[np.ndarray, pd.DataFrame]:
+        segment = self._segment(_registry_days(date, missing=0).item())
+        if segment not in self._snapshots:
+            day = self._boundaries[segment] if segment >= 0 else -1
+            rows = np.flatnonzero((self.admission_days <= day) & (day < self.abolition_days))
+            self._snapshots[segment] = rows, self.df.iloc[rows].reset_index(drop=True)
+        return self._snapshots[segment]
+
+    def record_rows(self, communes, dates) -> np.ndarray:
+        """
+        Rows of the records of communes on dates (-1 for communes not valid on the date).
+
+        Args:
+            communes: Commune codes (missing values as negative codes)
+            dates: A date for all communes or one date per commune
+        """
+        communes = np.asarray(communes, dtype=np.int64)
+        days = np.broadcast_to(_registry_days(dates, missing=0), communes.shape)
+        # The last record admitted on or before the date, if the commune matches and it is not abolished yet
+        positions = np.searchsorted(self._record_keys, (np.maximum(communes, 0) << _DAY_BITS) | days, side='right') - 1
+        rows = self._record_order[np.maximum(positions, 0)]
+        is_valid = (
+                (communes >= 0) & (positions >= 0)
+                & (self.df[COMMUNE_ATTR].to_numpy(np.int64)[rows] == communes)
+                & (days < self.abolition_days[rows])
+        )
+        return np.where(is_valid, rows, -1)
+
+
+@memoize(LOCATION_CACHE, dependencies=(load_communes_metadata,), disk=False)
+def get_commune_registry() -> CommuneRegistry:
+    """The interval index over the historical commune registry, see `CommuneRegistry`."""
+    return CommuneRegistry(load_communes_metadata())
+
+
 def load_communes_metadata_year(year: int) -> pd.DataFrame:
-    """Load communes metadata for the start of a specific year."""
-    date = datetime(year, 1, 1)
-    df = load_communes_metadata()
-    df = df[df['municipalityAdmissionDate'] <= date]
-    df = df[df['municipalityAbolitionDate'].isna() | (date < df['municipalityAbolitionDate'])]
-    return df.reset_index(drop=True)
+    """
+    Load communes metadata for the start of a specific year.
+
+    The result is a snapshot shared between calls (see `CommuneRegistry.valid_on`) and must not be modified.
+    """
+    return get_commune_registry().valid_on(datetime(year, 1, 1))
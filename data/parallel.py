@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from contextlib import contextmanager
+from multiprocessing import Pool
+from multiprocessing.pool import Pool as PoolType
+from typing import Iterator
+
+import numpy as np
+
+# State of a worker process of a `mapped_pool`: the arrays (memory-mapped) and the other state of the pool
+worker_state = {}
+
+
+def default_processes() -> int:
+    """All but one CPU."""
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def _init_worker(array_dir: str, state: dict):
+    worker_state.update(state)
+    for name in os.listdir(array_dir):
+        worker_state[name.removesuffix('.npy')] = np.load(os.path.join(array_dir, name), mmap_mode='r')
+
+
+@contextmanager
+def mapped_pool(arrays: dict[str, np.ndarray], state: dict = None, processes: int = None) -> Iterator[PoolType]:
+    """
+    Process pool whose workers share large arrays as memory-mapped files instead of receiving copies.
+
+    The arrays are written to a temporary directory once and the other state is sent to every worker
+    once when it starts, task functions find both by name in `worker_state`.
+
+    Args:
+        arrays: Arrays by name
+        state: Other (picklable) state by name
+        processes: Number of worker processes (default: all but one CPU)
+    """
+    with tempfile.TemporaryDirectory() as array_dir:
+        for name, array in arrays.items():
+            np.save(os.path.join(array_dir, name + '.npy'), np.ascontiguousarray(array))
+        with Pool(processes or default_processes(), initializer=_init_worker, initargs=(array_dir, state or {})) as pool:
+            yield pool
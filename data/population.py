@@ -1,80 +1,308 @@
-import functools
-from typing import cast
+import re
+import warnings
+from datetime import datetime
+from typing import BinaryIO, Callable, Iterator
 
 import numpy as np
 import pandas as pd
-from pyaxis import pyaxis
 
-from data.attribute import CACHE_TO_ATTR_MAPPER, ATTR_TO_CACHE_MAPPER, YEAR_ATTR, \
+from data.attribute import YEAR_ATTR, \
     IS_PERMANENT_RESIDENT_ATTR, IS_CITIZEN_ATTR, SEX_ATTR, AGE_ATTR, POPULATION_ATTR, \
     COMMUNE_SIZE_ATTR
-from data.cache import POPULATION_CACHE
+from data.cache import POPULATION_CACHE, memoize
 from data.location import COMMUNE_ATTR, CANTON_ATTR, load_cantons_metadata, \
-    load_communes_metadata_year
+    load_communes_metadata, get_commune_registry
 
+POPULATION_FILE = 'data_raw/bfs_population_commune_gender_age_2010_2023.px'
 
+_PX_KEY_PATTERN = re.compile(r'^([A-Za-z0-9-]+)(?:\[(\w+)])?(?:\("(.*)"\))?$')
+# Quoted data values are symbols for missing or confidential values
+_PX_SYMBOL_PATTERN = re.compile(rb'"[^"]*"')
+
+
+def _read_px_metadata(file: BinaryIO, encoding: str) -> dict[tuple[str, str | None, str | None], str]:
+    """
+    Read the metadata entries of a PX file up to the DATA keyword, leaving the file at the first data value.
+
+    Returns:
+        Raw value text by keyword, language (None for the default) and sub-key (e.g. the variable of VALUES)
+    """
+    metadata = {}
+    statement, in_quotes = '', False
+    while line := file.readline():
+        line = line.decode(encoding)
+        if not statement.strip() and not in_quotes and line.lstrip().startswith('DATA='):
+            # Continue reading right after the keyword
+            file.seek(file.tell() - len(line[line.index('DATA=') + 5:].encode(encoding)))
+            return metadata
+        for char in line:
+            if char == '"':
+                in_quotes = not in_quotes
+            if char == ';' and not in_quotes:
+                key, value = statement.strip().split('=', 1)
+                match = _PX_KEY_PATTERN.match(key.strip())
+                if match is None:
+                    raise ValueError(f"Invalid PX keyword '{key}'")
+                metadata[match.groups()] = value.strip()
+                statement = ''
+            else:
+                statement += char
+    raise ValueError('PX file without DATA')
+
+
+def _px_strings(value: str) -> list[str]:
+    return [string.strip() for string in re.findall(r'"([^"]*)"', value)]
+
+
+def read_px_dimensions(path: str, encoding: str, lang: str = None) -> dict[str, list[str]]:
+    """
+    Variables of a PX file in data order (stub, then heading) and their values.
+
+    Args:
+        path: The PX file
+        encoding: Encoding of the metadata
+        lang: Language of the variables and values (default: the default language of the file)
+    """
+    with open(path, 'rb') as file:
+        metadata = _read_px_metadata(file, encoding)
+
+    def entry(keyword: str, sub_key: str = None) -> str:
+        return metadata.get((keyword, lang, sub_key), metadata.get((keyword, None, sub_key), ''))
+
+    variables = _px_strings(entry('STUB')) + _px_strings(entry('HEADING'))
+    return {variable: _px_strings(entry('VALUES', variable)) for variable in variables}
+
+
+def _parse_px_values(data: bytes) -> np.ndarray:
+    """Parse whitespace separated data values, symbols (e.g. '"..."') become NaN."""
+    with warnings.catch_warnings():
+        # Unparsable values are only reported with a warning
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            if b'"' not in data:
+                return np.fromstring(data, dtype=np.int64, sep=' ')
+            return np.fromstring(_PX_SYMBOL_PATTERN.sub(b'nan', data), dtype=np.float64, sep=' ')
+        except DeprecationWarning:
+            raise ValueError('Invalid PX data values') from None
+
+
+def _iter_px_value_chunks(file: BinaryIO, read_size: int) -> Iterator[np.ndarray]:
+    """Parse the DATA block in pieces of about `read_size` bytes (cut between values)."""
+    rest = b''
+    while True:
+        data = file.read(read_size)
+        end = data.find(b';')
+        if end >= 0 or not data:
+            data = rest + (data[:end] if end >= 0 else data)
+            if data.strip():
+                yield _parse_px_values(data)
+            return
+        data = rest + data
+        cut = max(data.rfind(b' '), data.rfind(b'\n'))
+        if cut < 0:
+            rest = data
+            continue
+        data, rest = data[:cut], data[cut:]
+        yield _parse_px_values(data)
+
+
+def iter_px_data(
+        path: str,
+        encoding: str,
+        lang: str = None,
+        keep: dict[str, Callable[[str], bool]] = None,
+        chunk_size: int = 1 << 18,
+) -> Iterator[tuple[dict[str, np.ndarray], np.ndarray]]:
+    """
+    Stream the data of a PX file, skipping unwanted values of the variables (e.g. totals).
+
+    Only the data block is walked incrementally, skipped values are dropped per chunk
+    before anything else is allocated.
+
+    Args:
+        path: The PX file
+        encoding: Encoding of the metadata
+        lang: Language of the variables and values (default: the default language of the file)
+        keep: Predicate per variable on the value label, whether to keep the value (default: keep all)
+        chunk_size: Approximate number of data values per chunk
+
+    Returns:
+        Iterator of chunks: the index of the value of every variable (into the values of
+        `read_px_dimensions`) and the data values (NaN for symbols like '...')
+    """
+    dimensions = read_px_dimensions(path, encoding, lang)
+    keep = keep or {}
+    shape = tuple(len(values) for values in dimensions.values())
+    kept_indices = [
+        np.flatnonzero([keep.get(variable, lambda _: True)(value) for value in values])
+        for variable, values in dimensions.items()
+    ]
+
+    # The data is in C order of the variables: chunks of whole blocks of the inner variables
+    split = next(i for i in range(len(shape) + 1) if np.prod(shape[i:], dtype=np.int64) <= chunk_size)
+    outer_shape, inner_shape = shape[:split], shape[split:]
+    block_size = int(np.prod(inner_shape, dtype=np.int64))
+    blocks_per_chunk = max(1, chunk_size // block_size)
+    outer_keep = np.zeros(outer_shape, dtype=bool)
+    outer_keep[np.ix_(*kept_indices[:split])] = True
+    outer_keep = outer_keep.ravel()
+    inner_selection = np.ix_(*kept_indices[split:])
+    inner_codes = [
+        codes.ravel() for codes in np.meshgrid(*kept_indices[split:], indexing='ij')
+    ]
+    code_types = [np.min_scalar_type(max(len(values) - 1, 0)) for values in dimensions.values()]
+
+    def emit(values: np.ndarray, first_block: int):
+        blocks = np.arange(first_block, first_block + len(values) // block_size)
+        kept_blocks = blocks[outer_keep[blocks]]
+        n_inner = len(inner_codes[0]) if inner_codes else 1
+        codes = [
+            np.repeat(codes, n_inner).astype(code_type)
+            for codes, code_type in zip(np.unravel_index(kept_blocks, outer_shape) if outer_shape else (), code_types)
+        ] + [
+            np.tile(codes, len(kept_blocks)).astype(code_type)
+            for codes, code_type in zip(inner_codes, code_types[split:])
+        ]
+        values = values.reshape((-1,) + inner_shape)[outer_keep[blocks]]
+        return dict(zip(dimensions, codes)), values[(slice(None),) + inner_selection].ravel()
+
+    total_size = int(np.prod(shape, dtype=np.int64))
+    pending, pending_size, first_block = [], 0, 0
+    with open(path, 'rb') as file:
+        _read_px_metadata(file, encoding)
+        for values in _iter_px_value_chunks(file, read_size=chunk_size * 4):
+            pending.append(values)
+            pending_size += len(values)
+            if first_block * block_size + pending_size > total_size:
+                raise ValueError(f'PX data has more than {total_size} values')
+            while pending_size >= blocks_per_chunk * block_size:
+                values = np.concatenate(pending) if len(pending) > 1 else pending[0]
+                chunk_values = blocks_per_chunk * block_size
+                yield emit(values[:chunk_values], first_block)
+                first_block += blocks_per_chunk
+                pending, pending_size = [values[chunk_values:]], len(values) - chunk_values
+    if first_block * block_size + pending_size != total_size:
+        raise ValueError(f'PX data has {first_block * block_size + pending_size} values instead of {total_size}')
+    if pending_size:
+        yield emit(np.concatenate(pending), first_block)
+
+
+@memoize(POPULATION_CACHE, sources=(POPULATION_FILE,), memory=False)
 def _load_raw_bfs_population_cga():
-    # Slow to load
-    raw_df = pyaxis.parse(
-        'data_raw/bfs_population_commune_gender_age_2010_2023.px',
-        encoding='ISO-8859-15', lang='en'
-    )['DATA']
+    region, citizenship = 'Canton (-) / District (>>) / Commune (......)', 'Citizenship (category)'
     # Filter out cumulative rows
-    raw_df = raw_df[
-        (raw_df['Canton (-) / District (>>) / Commune (......)'].str.startswith('......')) &
-        (raw_df['Citizenship (category)'] != 'Citizenship (category) - total') &
-        (raw_df['Sex'] != 'Sex - total') &
-        (raw_df['Age'] != 'Age - total')
-        ].reset_index(drop=True)
-    # Convert to correct types
-    return pd.concat((
-        YEAR_ATTR.convert(raw_df['Year']),
-        COMMUNE_ATTR.convert(raw_df['Canton (-) / District (>>) / Commune (......)'].str.slice(6, 10)),
-        IS_PERMANENT_RESIDENT_ATTR.convert(
-            cast(pd.Series, raw_df['Population type'] == 'Permanent resident population')
+    keep = {
+        region: lambda value: value.startswith('......'),
+        citizenship: lambda value: value != 'Citizenship (category) - total',
+        'Sex': lambda value: value != 'Sex - total',
+        'Age': lambda value: value != 'Age - total',
+    }
+    dimensions = read_px_dimensions(POPULATION_FILE, encoding='ISO-8859-15', lang='en')
+
+    # Typed value of every (kept) value label, looked up by the codes
+    def lookup(variable: str, converter: Callable[[str], object], dtype) -> np.ndarray:
+        return np.array([
+            converter(value) if keep.get(variable, lambda _: True)(value) else 0
+            for value in dimensions[variable]
+        ], dtype=dtype)
+
+    lookups = {
+        'Year': lookup('Year', int, YEAR_ATTR.type),
+        region: lookup(region, lambda value: int(value[6:10]), np.int16),
+        'Population type': lookup(
+            'Population type', lambda value: value == 'Permanent resident population', IS_PERMANENT_RESIDENT_ATTR.type
         ),
-        IS_CITIZEN_ATTR.convert(cast(pd.Series, raw_df['Citizenship (category)'] == 'Switzerland')),
-        SEX_ATTR.convert(cast(pd.Series, raw_df['Sex'])),
-        AGE_ATTR.convert(raw_df['Age'].str.split(' ', n=1).str[0]),
-        POPULATION_ATTR.convert(raw_df['DATA'])
-    ), axis=1)
-
-
-def _population_to_commune_size(population: np.number) -> str | None:
-    if np.isnan(population):
-        return None
-    if population > 100000:
-        return '> 100\'000'
-    if population > 50000:
-        return '50\'000-99\'999'
-    if population > 20000:
-        return '20\'000-49\'999'
-    if population > 10000:
-        return '10\'000-19\'999'
-    if population > 5000:
-        return '5\'000-9\'999'
-    if population > 2000:
-        return '2\'000-4\'999'
-    if population > 1000:
-        return '1\'000-1\'999'
-    return '1-999'
-
-
-@functools.cache
-def get_bfs_population_cga() -> pd.DataFrame:
-    cache_file = POPULATION_CACHE.dir().joinpath('population_cga.feather')
-    if cache_file.exists():
-        df = pd.read_feather(cache_file).rename(CACHE_TO_ATTR_MAPPER, axis=1)
-    else:
-        df = _load_raw_bfs_population_cga()
-        df.rename(ATTR_TO_CACHE_MAPPER, axis=1).to_feather(cache_file)
-    df[COMMUNE_SIZE_ATTR] = df.groupby([YEAR_ATTR, COMMUNE_ATTR])[POPULATION_ATTR] \
-        .transform(lambda x: _population_to_commune_size(x.sum()))
-    df[CANTON_ATTR] = CANTON_ATTR.convert(
-        # Groups using communes from 2023 no matter the statistic year
-        df[COMMUNE_ATTR].map(load_communes_metadata_year(2023).set_index(COMMUNE_ATTR).cantonAbbreviation)
-        .map(load_cantons_metadata().set_index('cantonAbbreviation')[CANTON_ATTR])
+        citizenship: lookup(citizenship, lambda value: value == 'Switzerland', IS_CITIZEN_ATTR.type),
+        'Sex': lookup(
+            'Sex', lambda value: SEX_ATTR.categories.index(value) if value in SEX_ATTR.categories else -1, np.int8
+        ),
+        'Age': lookup('Age', lambda value: int(value.split(' ', 1)[0]), AGE_ATTR.type),
+    }
+
+    # Fill the typed columns chunk by chunk
+    size = int(np.prod([
+        sum(keep.get(variable, lambda _: True)(value) for value in values)
+        for variable, values in dimensions.items()
+    ]))
+    columns = {variable: np.empty(size, dtype=values.dtype) for variable, values in lookups.items()}
+    population = np.empty(size, dtype=POPULATION_ATTR.type)
+    position = 0
+    for codes, values in iter_px_data(POPULATION_FILE, encoding='ISO-8859-15', lang='en', keep=keep):
+        chunk = slice(position, position + len(values))
+        for variable, variable_lookup in lookups.items():
+            columns[variable][chunk] = variable_lookup[codes[variable]]
+        population[chunk] = POPULATION_ATTR.convert(pd.Series(values))
+        position += len(values)
+
+    return pd.DataFrame({
+        YEAR_ATTR: columns['Year'],
+        COMMUNE_ATTR: pd.array(columns[region], dtype=COMMUNE_ATTR.type),
+        IS_PERMANENT_RESIDENT_ATTR: columns['Population type'],
+        IS_CITIZEN_ATTR: columns[citizenship],
+        SEX_ATTR: pd.Categorical.from_codes(columns['Sex'], categories=SEX_ATTR.categories, ordered=SEX_ATTR.ordered),
+        AGE_ATTR: columns['Age'],
+        POPULATION_ATTR: population,
+    }, copy=False)
+
+
+# Exclusive lower bounds of the commune sizes after the first (e.g. more than 1000 inhabitants for '1'000-1'999')
+COMMUNE_SIZE_LOWER_BOUNDS = np.array([1000, 2000, 5000, 10000, 20000, 50000, 100000])
+
+
+def _commune_sizes(df: pd.DataFrame) -> pd.Series:
+    """Size category of the commune of every row, from the total population of the commune per year."""
+    group_codes = df.groupby([YEAR_ATTR, COMMUNE_ATTR], sort=False).ngroup().to_numpy(np.int64, na_value=-1)
+    is_grouped = group_codes >= 0
+    totals = np.bincount(
+        group_codes[is_grouped],
+        weights=df[POPULATION_ATTR].to_numpy(np.float64)[is_grouped]
     )
+    size_codes = np.searchsorted(COMMUNE_SIZE_LOWER_BOUNDS, totals, side='left')
+    codes = np.full(len(df), -1, dtype=np.int8)
+    codes[is_grouped] = size_codes[group_codes[is_grouped]]
+    return pd.Series(pd.Categorical.from_codes(
+        codes, categories=COMMUNE_SIZE_ATTR.categories, ordered=COMMUNE_SIZE_ATTR.ordered
+    ), index=df.index, name=COMMUNE_SIZE_ATTR)
+
+
+def _commune_cantons(communes: pd.Series, years: pd.Series) -> pd.Series:
+    """Canton of every commune, using the communes at the end of every row's year (when the population is counted)."""
+    registry = get_commune_registry()
+    canton_codes = registry.df.cantonAbbreviation.map(
+        load_cantons_metadata().set_index('cantonAbbreviation')[CANTON_ATTR]
+    ).to_numpy(np.int64, na_value=-1)
+    registry_codes = registry.df[COMMUNE_ATTR].to_numpy(np.int64)
+    commune_codes = np.arange(registry_codes.max(initial=-1) + 1)
+    # Communes that are not valid in a year (e.g. counted on the boundaries of another year) use their latest canton
+    order = np.lexsort((registry.admission_days, registry_codes))
+    latest_rows = order[np.append(registry_codes[order][1:] != registry_codes[order][:-1], True)]
+    latest_cantons = np.full(len(commune_codes), -1, dtype=np.int64)
+    latest_cantons[registry_codes[latest_rows]] = canton_codes[latest_rows]
+
+    # Lookup array indexed by year and commune code, -1 for unknown communes
+    year_values = years.to_numpy(np.int64)
+    first_year = year_values.min(initial=0)
+    lookup = np.full((year_values.max(initial=0) - first_year + 1, len(commune_codes)), -1, dtype=np.int64)
+    for year in np.unique(year_values):
+        rows = registry.record_rows(commune_codes, datetime(int(year), 12, 31))
+        lookup[year - first_year] = np.where(rows >= 0, canton_codes[rows], latest_cantons)
+
+    codes = communes.to_numpy(np.int64, na_value=-1)
+    is_known = (codes >= 0) & (codes < len(commune_codes))
+    cantons = np.where(is_known, lookup[year_values - first_year, np.where(is_known, codes, 0)], -1)
+    return pd.Series(
+        pd.arrays.IntegerArray(cantons, cantons < 0), index=communes.index, name=CANTON_ATTR
+    ).astype(CANTON_ATTR.type)
+
+
+@memoize(POPULATION_CACHE, dependencies=(
+        _load_raw_bfs_population_cga, load_communes_metadata, load_cantons_metadata, get_commune_registry
+))
+def get_bfs_population_cga() -> pd.DataFrame:
+    df = _load_raw_bfs_population_cga()
+    df[COMMUNE_SIZE_ATTR] = _commune_sizes(df)
+    # Communes of the statistic year, see `get_commune_mapping` to harmonize them to the communes of one year
+    df[CANTON_ATTR] = _commune_cantons(df[COMMUNE_ATTR], df[YEAR_ATTR])
     return df
 
 
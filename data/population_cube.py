@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable, Hashable
+
+import numpy as np
+import pandas as pd
+
+from data.attribute import Attribute, CategoricalAttribute, YEAR_ATTR, IS_PERMANENT_RESIDENT_ATTR, \
+    IS_CITIZEN_ATTR, SEX_ATTR, AGE_ATTR, POPULATION_ATTR, COMMUNE_SIZE_ATTR
+from data.cache import POPULATION_CACHE, memoize
+from data.location import COMMUNE_ATTR, CANTON_ATTR
+from data.population import get_bfs_population_cga
+
+CUBE_AXES = (YEAR_ATTR, COMMUNE_ATTR, IS_PERMANENT_RESIDENT_ATTR, IS_CITIZEN_ATTR, SEX_ATTR, AGE_ATTR)
+
+
+def _labels(attribute: Attribute, values) -> pd.Index:
+    """Index of axis or group labels with the dtype of the attribute (as in a groupby result)."""
+    if isinstance(attribute, CategoricalAttribute):
+        return pd.CategoricalIndex(values, categories=attribute.categories, ordered=attribute.ordered,
+                                   name=attribute)
+    return pd.Index(pd.array(values, dtype=attribute.type), name=attribute)
+
+
+def _indexer(positions: np.ndarray) -> slice | np.ndarray:
+    """Slice for contiguous positions (so selections are views), else the positions."""
+    if len(positions) and np.array_equal(positions, np.arange(positions[0], positions[0] + len(positions))):
+        return slice(positions[0], positions[0] + len(positions))
+    return positions
+
+
+class PopulationCube:
+    """
+    Dense population counts with one axis per attribute (see `CUBE_AXES`).
+
+    Communes are additionally grouped (per year) into cantons and commune sizes, so margins of
+    these can be computed without expanding the cube. Selections and margins are array
+    operations, margins are Series like ``groupby(attributes, observed=True)[POPULATION_ATTR].sum()``
+    and can be used as targets of a `MarginalCorrector`.
+    """
+
+    def __init__(
+            self,
+            values: np.ndarray,
+            labels: dict[Attribute, pd.Index],
+            groups: dict[Attribute, tuple[tuple[Attribute, ...], np.ndarray, pd.Index]],
+    ):
+        """
+        Args:
+            values: Population counts with one axis per label index
+            labels: The labels of every axis, in axis order
+            groups: Grouping attributes: the axes they group, the group code for every cell of
+                these axes (-1 for unknown) and the group labels
+        """
+        self.values = values
+        self.labels = labels
+        self.groups = groups
+
+    @property
+    def axes(self) -> tuple[Attribute, ...]:
+        return tuple(self.labels)
+
+    def _axis(self, attribute: Attribute) -> int:
+        return self.axes.index(attribute)
+
+    def total(self) -> int:
+        return int(self.values.sum(dtype=np.uint64))
+
+    def select(self, attribute: Attribute, values: Hashable | list | Callable[[pd.Index], np.ndarray]) -> PopulationCube:
+        """
+        Restrict the cube to some values of an axis or group attribute.
+
+        Args:
+            attribute: The attribute to select by
+            values: A single value, a list of values or a predicate on the labels (e.g. ``lambda ages: ages >= 18``)
+        """
+        labels = self.labels[attribute] if attribute in self.labels else self.groups[attribute][2]
+        if callable(values):
+            mask = np.asarray(values(labels), dtype=bool)
+        else:
+            mask = labels.isin(values if isinstance(values, list) else [values])
+
+        if attribute in self.labels:
+            return self._take(self._axis(attribute), _indexer(np.flatnonzero(mask)))
+
+        group_axes, codes, _ = self.groups[attribute]
+        cell_mask = np.append(mask, False)[codes]
+        if len(group_axes) == 1:
+            return self._take(self._axis(group_axes[0]), _indexer(np.flatnonzero(cell_mask)))
+        # Groups over several axes cannot be sliced, the other cells are zeroed instead
+        shape = [1] * self.values.ndim
+        for axis, size in zip((self._axis(group_axis) for group_axis in group_axes), codes.shape):
+            shape[axis] = size
+        order = np.argsort([self._axis(group_axis) for group_axis in group_axes])
+        return PopulationCube(
+            self.values * cell_mask.transpose(order).reshape(shape).astype(self.values.dtype),
+            self.labels, self.groups
+        )
+
+    def _take(self, axis: int, indexer: slice | np.ndarray) -> PopulationCube:
+        attribute = self.axes[axis]
+        selection = (slice(None),) * axis + (indexer,)
+        labels = dict(self.labels)
+        labels[attribute] = self.labels[attribute][indexer]
+        groups = {}
+        for group, (group_axes, codes, group_labels) in self.groups.items():
+            if attribute in group_axes:
+                group_axis = group_axes.index(attribute)
+                codes = codes[(slice(None),) * group_axis + (indexer,)]
+            groups[group] = (group_axes, codes, group_labels)
+        return PopulationCube(self.values[selection], labels, groups)
+
+    def year(self, year: int) -> PopulationCube:
+        return self.select(YEAR_ATTR, year)
+
+    def electorate(self, year: int = None) -> PopulationCube:
+        """The citizens of voting age, see `data.population.can_vote_mask`."""
+        cube = self if year is None else self.year(year)
+        return cube.select(IS_CITIZEN_ATTR, True).select(AGE_ATTR, lambda ages: ages >= 18)
+
+    def margin(self, *attributes: Attribute) -> pd.Series:
+        """
+        Population per value (or combination of values) of axis or group attributes.
+
+        Combinations without any cell (e.g. a canton and a commune size that do not occur together)
+        are left out, unknown groups are dropped.
+        """
+        group_axes = {
+            attribute: self.groups[attribute][0] if attribute in self.groups else (attribute,)
+            for attribute in attributes
+        }
+        kept_axes = [axis for axis in self.axes if any(axis in axes for axes in group_axes.values())]
+        summed = self.values.sum(
+            axis=tuple(i for i, axis in enumerate(self.axes) if axis not in kept_axes), dtype=np.uint64
+        )
+
+        # Fast path for a single axis: the sums are the margin
+        if len(attributes) == 1 and attributes[0] in self.labels:
+            return pd.Series(summed, index=self.labels[attributes[0]], name=POPULATION_ATTR)
+
+        # Codes of every attribute for every cell of the kept axes
+        codes, labels = [], []
+        for attribute in attributes:
+            if attribute in self.labels:
+                attribute_codes, attribute_labels = np.arange(len(self.labels[attribute])), self.labels[attribute]
+            else:
+                _, attribute_codes, attribute_labels = self.groups[attribute]
+            axes = group_axes[attribute]
+            # Broadcast over the kept axes (group codes are in the order of their axes)
+            order = np.argsort([kept_axes.index(axis) for axis in axes])
+            shape = [len(self.labels[axis]) if axis in axes else 1 for axis in kept_axes]
+            codes.append(np.broadcast_to(
+                np.asarray(attribute_codes).transpose(order).reshape(shape), summed.shape
+            ).ravel())
+            labels.append(attribute_labels)
+
+        is_known = np.logical_and.reduce([attribute_codes >= 0 for attribute_codes in codes])
+        shape = tuple(len(attribute_labels) for attribute_labels in labels)
+        keys = np.ravel_multi_index([attribute_codes[is_known] for attribute_codes in codes], shape)
+        size = int(np.prod(shape))
+        sums = np.bincount(keys, weights=summed.ravel()[is_known], minlength=size)
+        occurring = np.flatnonzero(np.bincount(keys, minlength=size))
+        positions = np.unravel_index(occurring, shape)
+        if len(attributes) == 1:
+            index = labels[0][positions[0]]
+        else:
+            index = pd.MultiIndex.from_arrays([
+                attribute_labels[attribute_positions]
+                for attribute_labels, attribute_positions in zip(labels, positions)
+            ], names=attributes)
+        return pd.Series(sums[occurring].astype(np.uint64), index=index, name=POPULATION_ATTR)
+
+
+def population_cube(df: pd.DataFrame) -> PopulationCube:
+    """Build a cube from a population DataFrame, see `get_bfs_population_cga`."""
+    labels = {}
+    codes = []
+    for attribute in CUBE_AXES:
+        if isinstance(attribute, CategoricalAttribute):
+            labels[attribute] = _labels(attribute, attribute.categories)
+            codes.append(pd.Categorical(df[attribute], categories=attribute.categories).codes.astype(np.int64))
+        else:
+            attribute_codes, uniques = pd.factorize(df[attribute], sort=True)
+            labels[attribute] = _labels(attribute, uniques)
+            codes.append(attribute_codes.astype(np.int64))
+    shape = tuple(len(attribute_labels) for attribute_labels in labels.values())
+    is_known = np.logical_and.reduce([attribute_codes >= 0 for attribute_codes in codes])
+    cells = np.ravel_multi_index([attribute_codes[is_known] for attribute_codes in codes], shape)
+    values = np.bincount(
+        cells, weights=df[POPULATION_ATTR].to_numpy(np.float64)[is_known], minlength=int(np.prod(shape))
+    ).astype(POPULATION_ATTR.type).reshape(shape)
+
+    year_codes, commune_codes = codes[0], codes[1]
+    is_known = (commune_codes >= 0) & (year_codes >= 0)
+    group_shape = (len(labels[YEAR_ATTR]), len(labels[COMMUNE_ATTR]))
+
+    # Canton of every commune and year (communes can change canton, e.g. Moutier in 2026)
+    canton_values, canton_labels = pd.factorize(df[CANTON_ATTR], sort=True)
+    canton_codes = np.full(group_shape, -1, dtype=np.int64)
+    canton_codes[year_codes[is_known], commune_codes[is_known]] = canton_values[is_known]
+
+    # Commune size of every commune and year
+    size_codes = np.full(group_shape, -1, dtype=np.int64)
+    size_values = pd.Categorical(df[COMMUNE_SIZE_ATTR], categories=COMMUNE_SIZE_ATTR.categories).codes
+    size_codes[year_codes[is_known], commune_codes[is_known]] = size_values[is_known]
+
+    return PopulationCube(values, labels, {
+        CANTON_ATTR: ((YEAR_ATTR, COMMUNE_ATTR), canton_codes, _labels(CANTON_ATTR, canton_labels)),
+        COMMUNE_SIZE_ATTR: (
+            (YEAR_ATTR, COMMUNE_ATTR), size_codes, _labels(COMMUNE_SIZE_ATTR, COMMUNE_SIZE_ATTR.categories)
+        ),
+    })
+
+
+@memoize(POPULATION_CACHE, dependencies=(get_bfs_population_cga,))
+def get_population_cube() -> PopulationCube:
+    return population_cube(get_bfs_population_cga())
+
+
+# Margins of the electorate used as weighting targets
+TARGET_MARGINS = (
+    (AGE_ATTR,), (SEX_ATTR,), (CANTON_ATTR,), (COMMUNE_SIZE_ATTR,),
+    (AGE_ATTR, SEX_ATTR), (SEX_ATTR, CANTON_ATTR),
+)
+
+
+@dataclass(frozen=True)
+class ElectorateTargets:
+    """Precomputed margins and total of an electorate, so raking targets are simple lookups."""
+    total: int
+    margins: dict[tuple[Attribute, ...], pd.Series]
+
+    def margin(self, *attributes: Attribute) -> pd.Series:
+        return self.margins[attributes]
+
+
+def electorate_targets(
+        electorate: pd.DataFrame | PopulationCube,
+        margins: tuple[tuple[Attribute, ...], ...] = TARGET_MARGINS,
+) -> ElectorateTargets:
+    """
+    Compute the weighting targets of an electorate.
+
+    Args:
+        electorate: The electorate dataframe or cube (e.g. ``cube.electorate(year)``)
+        margins: The attributes of every margin to compute
+    """
+    if isinstance(electorate, PopulationCube):
+        return ElectorateTargets(electorate.total(), {
+            attributes: electorate.margin(*attributes) for attributes in margins
+        })
+    return ElectorateTargets(int(electorate[POPULATION_ATTR].sum()), {
+        attributes: electorate.groupby(
+            list(attributes) if len(attributes) > 1 else attributes[0], observed=True
+        )[POPULATION_ATTR].sum()
+        for attributes in margins
+    })
+
+
+@memoize(POPULATION_CACHE, dependencies=(get_population_cube,))
+def get_electorate_targets(year: int) -> ElectorateTargets:
+    """The weighting targets of the electorate of a year (see `TARGET_MARGINS`), cached on disk."""
+    return electorate_targets(get_population_cube().electorate(year))
@@ -1,4 +1,4 @@
-from data.attribute import SEX_ATTR, AGE_ATTR
+from data.attribute import SEX_ATTR, AGE_ATTR, YEAR_ATTR, COMMUNE_SIZE_ATTR
 
 AGE_WEIGHT = 'weight_age'
 TOTAL_WEIGHT = 'weighttot'  # Existing column name
@@ -473,3 +473,35 @@ SELECTS_POLITICAL_COLUMNS = (
         SELECTS_CAMPAIGN_INFORMATION_COLUMNS +
         SELECTS_SLOGANS_OF_POLITICAL_PARTIES_COLUMNS
 )
+
+# Compact storage kinds of the columns (see `data.selects.schema`), other columns are inferred from their values
+LABELLED_KIND = 'labelled'  # Categorical
+CODE_KIND = 'code'  # Smallest (nullable) integer, kept as is with fractions
+CONTINUOUS_KIND = 'continuous'  # float32
+EXACT_KIND = 'exact'  # Kept as is
+SELECTS_COLUMN_KINDS = {
+    **dict.fromkeys(
+        SELECTS_SOCIAL_CLASS_COLUMNS + SELECTS_ECONOMIC_SITUATION_COLUMNS +
+        SELECTS_POLITICAL_INTEREST_COLUMNS + SELECTS_POLITICAL_KNOWLEDGE_COLUMNS +
+        SELECTS_PARTY_IDENTIFICATION_COLUMNS + SELECTS_POLITICAL_EFFICACY_COLUMNS +
+        SELECTS_EVALUATION_OF_THE_POLITICAL_SYSTEM_COLUMNS + SELECTS_MOST_IMPORTANT_PROBLEM_COLUMNS +
+        SELECTS_ISSUE_IMPORTANCE_COLUMNS + SELECTS_ISSUE_POSITION_COLUMNS + SELECTS_ATTACHMENT_COLUMNS +
+        SELECTS_ECONOMIC_EVALUATIONS_COLUMNS + SELECTS_EVALUATION_OF_POLITICAL_PARTIES_COLUMNS +
+        SELECTS_MEDIA_USE_COLUMNS + SELECTS_CAMPAIGN_INFORMATION_COLUMNS +
+        SELECTS_SLOGANS_OF_POLITICAL_PARTIES_COLUMNS + SELECTS_INFORMATION_INTERVIEW_COLUMNS +
+        ['vp1', 'sg1', 'sg9', 'maritals', 'educ', 'religion', 'churchg'],
+        LABELLED_KIND
+    ),
+    **dict.fromkeys(
+        SELECTS_PROBABILITY_TO_VOTE_COLUMNS + SELECTS_SYMPATHY_PERSONALITIES_COLUMNS +
+        SELECTS_TRUST_IN_POLITICAL_INSTITUTIONS_COLUMNS +
+        [RESPONDENT_ID, 'useridpy', 'sg5', 'sg6', 'sg10a', 'sh1', 'sh2a', 'sh2b', 'sh2c'],
+        CODE_KIND
+    ),
+    **dict.fromkeys(['income_sfr', 'sg7a'], CONTINUOUS_KIND),
+    # Processed columns and weights
+    **dict.fromkeys(
+        [YEAR_ATTR, SEX_ATTR, AGE_ATTR, COMMUNE_SIZE_ATTR, 'sg2', 'sg3', 'sg4', TOTAL_WEIGHT, AGE_WEIGHT],
+        EXACT_KIND
+    ),
+}
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Collection, Hashable
+
+import pandas as pd
+
+from data.attribute import ATTR_TO_CACHE_MAPPER, CACHE_TO_ATTR_MAPPER, YEAR_ATTR, AGE_ATTR, SEX_ATTR
+from data.cache import WEIGHTS_CACHE, fingerprint, memoize
+from data.parallel import default_processes, mapped_pool
+from data.population_cube import get_electorate_targets
+from data.selects.columns import TOTAL_WEIGHT, AGE_WEIGHT, RESPONDENT_ID
+from data.selects.process import WEIGHTING_SOURCES, post_process_selects
+from data.selects.source import get_fors_selects, get_selects_year_stamps
+
+# Columns of the weighted output, the other columns can be joined from `get_fors_selects` by respondent
+SELECTS_WEIGHTED_COLUMNS = (RESPONDENT_ID, YEAR_ATTR, AGE_ATTR, SEX_ATTR, 'sg3', AGE_WEIGHT, TOTAL_WEIGHT)
+
+
+def _default_output_dir() -> Path:
+    return WEIGHTS_CACHE.dir().joinpath('selects_years')
+
+
+# Only keyed (on the weighting code, the respondents and targets of the year and the parameters),
+# the year files are the stored result
+@memoize(WEIGHTS_CACHE, sources=WEIGHTING_SOURCES, hash_sources=True, memory=False, disk=False)
+def _weight_selects_year(
+        year: int,
+        selects_stamp: str,
+        targets_stamp: str,
+        acceptable_correction: float,
+        age_std: float,
+        columns: tuple[Hashable, ...],
+) -> pd.DataFrame:
+    selects_year_df = get_fors_selects(years=[year]).dropna(axis=1, how='all')
+    spread = post_process_selects(
+        selects_year_df, get_electorate_targets(year),
+        acceptable_correction=acceptable_correction,
+        age_std=age_std,
+        materialize=False,
+    )
+    return spread.materialize([column for column in columns if column in spread.columns])
+
+
+def _run_year(task: tuple[tuple, Path]) -> int:
+    """Weight a year and write it to its file (through a temporary file, never leaving an incomplete one)."""
+    arguments, path = task
+    df = _weight_selects_year(*arguments).rename(ATTR_TO_CACHE_MAPPER, axis=1)
+    tmp_path = path.with_name(path.name + '.tmp')
+    df.to_feather(tmp_path)
+    os.replace(tmp_path, path)
+    return arguments[0]
+
+
+def _year_files(
+        years: Collection[int] | None,
+        acceptable_correction: float,
+        age_std: float,
+        columns: tuple[Hashable, ...],
+        output_dir: Path,
+) -> dict[int, tuple[tuple, Path]]:
+    """The weighting arguments and the file of every year for the current respondents, targets and parameters."""
+    selects_stamps = get_selects_year_stamps()
+    if years is None:
+        # Years without population data have no targets to weight against
+        years = [year for year in sorted(selects_stamps) if get_electorate_targets(year).total > 0]
+    files = {}
+    for year in sorted({int(year) for year in years}):
+        # The targets are computed (and cached) before forking, so the workers only load them
+        targets = get_electorate_targets(year)
+        if targets.total == 0:
+            raise ValueError(f'No electorate of {year} in the population data to weight the Selects against')
+        arguments = (
+            year, selects_stamps[year], fingerprint(targets.total, targets.margins),
+            acceptable_correction, age_std, columns,
+        )
+        files[year] = (arguments, output_dir.joinpath(f'{year}.{_weight_selects_year.key(*arguments)}.feather'))
+    return files
+
+
+def run_selects_pipeline(
+        years: Collection[int] = None,
+        acceptable_correction: float = 5.0,
+        age_std: float = 3.0,
+        columns: Collection[Hashable] = SELECTS_WEIGHTED_COLUMNS,
+        output_dir: Path | str = None,
+        processes: int = None,
+) -> dict[int, Path]:
+    """
+    Spread and weight every Selects year against its electorate (see `post_process_selects`) and write
+    the spread respondents with their weights to one feather file per year.
+
+    Every file is stamped with the respondents of its year, the electorate targets of its year, the
+    parameters and the source of the weighting modules (see `WEIGHTING_SOURCES`). Years whose file is up
+    to date are skipped, the others are weighted in parallel worker processes. Years without electorate
+    in the population data raise a `ValueError`, as there is nothing to weight them against.
+
+    Args:
+        years: Years to weight (default: all Selects years with population data)
+        acceptable_correction: Maximum allowed over- or under-weighting for correction
+        age_std: Standard deviation for age spreading
+        columns: Columns of the output (missing columns of a year are left out)
+        output_dir: Directory of the year files (default: in the weights cache)
+        processes: Number of worker processes (default: all but one CPU)
+
+    Returns:
+        The file of every weighted year, see `read_weighted_selects`
+    """
+    output_dir = _default_output_dir() if output_dir is None else Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    files, tasks = {}, []
+    for year, (arguments, path) in _year_files(years, acceptable_correction, age_std, tuple(columns),
+                                               output_dir).items():
+        files[year] = path
+        for stale_file in output_dir.glob(f'{year}.*.feather'):
+            if stale_file != path:
+                stale_file.unlink()
+        if not path.exists():
+            tasks.append((arguments, path))
+
+    if tasks:
+        with mapped_pool({}, processes=min(processes or default_processes(), len(tasks))) as pool:
+            for _ in pool.imap_unordered(_run_year, tasks):
+                pass
+    return files
+
+
+def read_weighted_selects(
+        years: Collection[int] = None,
+        columns: Collection[Hashable] = None,
+        acceptable_correction: float = 5.0,
+        age_std: float = 3.0,
+        weighted_columns: Collection[Hashable] = SELECTS_WEIGHTED_COLUMNS,
+        output_dir: Path | str = None,
+) -> pd.DataFrame:
+    """
+    Read the weighted Selects written by `run_selects_pipeline`.
+
+    Only the files of the given parameters and of the current respondents, targets and weighting code
+    are read (files of other runs in the same directory are ignored), a missing or outdated year raises
+    a `FileNotFoundError`.
+
+    Args:
+        years: Years to read (default: all Selects years with population data)
+        columns: Columns to read (default: all)
+        acceptable_correction: The `acceptable_correction` the years were weighted with
+        age_std: The `age_std` the years were weighted with
+        weighted_columns: The `columns` the years were weighted with
+        output_dir: Directory of the year files (default: in the weights cache)
+
+    Returns:
+        DataFrame with one row per spread respondent and year
+    """
+    output_dir = _default_output_dir() if output_dir is None else Path(output_dir)
+    files = _year_files(years, acceptable_correction, age_std, tuple(weighted_columns), output_dir)
+    missing = [year for year, (_, path) in files.items() if not path.exists()]
+    if not files or missing:
+        raise FileNotFoundError(
+            f'No up-to-date weighted Selects of {missing or "any year"} in {output_dir}, see `run_selects_pipeline`'
+        )
+    columns = None if columns is None else [ATTR_TO_CACHE_MAPPER.get(column, column) for column in columns]
+    frames = [pd.read_feather(path, columns=columns) for _, path in files.values()]
+    return pd.concat(frames, ignore_index=True).rename(CACHE_TO_ATTR_MAPPER, axis=1)
@@ -1,10 +1,15 @@
-import numpy as np
+import inspect
+
 import pandas as pd
 
-from data.attribute import SEX_ATTR, AGE_ATTR, POPULATION_ATTR
+from data.attribute import SEX_ATTR, AGE_ATTR
+from data.cache import WEIGHTS_CACHE, memoize
 from data.location import CANTON_ATTR
-from data.selects.columns import TOTAL_WEIGHT, AGE_WEIGHT
-from data.weights import rake_survey_weights, create_marginal_corrector
+from data.population_cube import ElectorateTargets, electorate_targets, get_electorate_targets
+from data.selects.columns import TOTAL_WEIGHT
+from data.selects.source import get_fors_selects
+from data.selects.spread import SpreadFrame, spread_age_frame
+from data.weights import Corrector, MarginalCorrector, RakingCheckpoints, rake_survey_weights
 
 
 def spread_age(
@@ -16,76 +21,56 @@ def spread_age(
 ) -> pd.DataFrame:
     """
     Spread every respondent to multiple ages and weight using a Gaussian kernel.
+
+    Materializes all columns for every spread row, see `spread_age_frame` for an implicit variant.
     """
-    # Offsets and raw Gaussian weights for candidates.
-    kernel_radius = int(np.ceil(kernel_size_std * age_std))
-    offsets = np.arange(-kernel_radius, kernel_radius + 1)
-    kernel = np.exp(-0.5 * (offsets / age_std) ** 2)
+    return spread_age_frame(df, age_std, min_age, max_age, kernel_size_std).materialize()
 
-    # Create candidate ages and corresponding weights.
-    candidate_ages = df[AGE_ATTR].values[:, None] + offsets  # shape: (n, n_offsets)
-    candidate_weights = np.tile(kernel, (len(df), 1))
 
-    # Duplicate the DataFrame for each offset.
-    duplicated_df = df.loc[df.index.repeat(len(offsets))].copy()
-    duplicated_df[AGE_ATTR] = candidate_ages.flatten()
-    duplicated_df[AGE_WEIGHT] = candidate_weights.flatten()
+# Margins of the electorate the selects years are corrected to
+SELECTS_YEAR_MARGINS = ((AGE_ATTR,), (SEX_ATTR,), (CANTON_ATTR,))
 
-    # Keep only candidates within the allowed age range.
-    valid = (duplicated_df[AGE_ATTR] >= min_age) & (duplicated_df[AGE_ATTR] <= max_age)
-    duplicated_df = duplicated_df[valid].copy().reset_index(drop=True)
 
-    # Normalize and update weights
-    duplicated_df[AGE_WEIGHT] /= duplicated_df[AGE_WEIGHT].mean()
-    duplicated_df[TOTAL_WEIGHT] = duplicated_df[TOTAL_WEIGHT] * duplicated_df[AGE_WEIGHT]
-    return duplicated_df
+def create_selects_year_correctors(electorate_df: pd.DataFrame | ElectorateTargets) -> list[Corrector]:
+    """Create the raking functions that match a selects year to its electorate (or its precomputed targets)."""
+    targets = electorate_df if isinstance(electorate_df, ElectorateTargets) \
+        else electorate_targets(electorate_df, SELECTS_YEAR_MARGINS)
+    return [
+        MarginalCorrector(sample_col=AGE_ATTR, target_dist=targets.margin(AGE_ATTR), target_total=targets.total),
+        MarginalCorrector(sample_col=SEX_ATTR, target_dist=targets.margin(SEX_ATTR), target_total=targets.total),
+        MarginalCorrector(sample_col='sg3', target_dist=targets.margin(CANTON_ATTR), target_total=targets.total),
+        # TODO: add participation rate and party correction
+    ]
 
 
 def correct_selects_year_weights(
-        selects_df: pd.DataFrame,
-        electorate_df: pd.DataFrame,
+        selects_df: pd.DataFrame | SpreadFrame,
+        electorate_df: pd.DataFrame | ElectorateTargets,
         acceptable_correction: float = 5.0,
         external_weights: pd.Series = None,
+        checkpoints: RakingCheckpoints = None,
 ) -> pd.DataFrame:
     """
     Correct the demographic distribution of a selects survey dataframe to match
     the distribution in the electorate.
 
     Args:
-        selects_df: The selects dataframe
-        electorate_df: The electorate dataframe
+        selects_df: The selects dataframe (or an implicit spread of it)
+        electorate_df: The electorate dataframe or its precomputed targets (see `get_electorate_targets`)
         acceptable_correction: Maximum allowed over- or under-weighting for correction
         external_weights: Optional Series of external weights to incorporate
+        checkpoints: Optional store of previous solutions to continue from (and save to)
 
     Returns:
-        DataFrame with corrected demographic weights
+        DataFrame (or implicit spread) with corrected demographic weights
     """
     raked_weights = rake_survey_weights(
         sample_df=selects_df,
-        raking_functions=[
-            create_marginal_corrector(
-                sample_col=AGE_ATTR,
-                population_df=electorate_df,
-                pop_col=AGE_ATTR,
-                pop_weight_col=POPULATION_ATTR
-            ),
-            create_marginal_corrector(
-                sample_col=SEX_ATTR,
-                population_df=electorate_df,
-                pop_col=SEX_ATTR,
-                pop_weight_col=POPULATION_ATTR
-            ),
-            create_marginal_corrector(
-                sample_col='sg3',
-                population_df=electorate_df,
-                pop_col=CANTON_ATTR,
-                pop_weight_col=POPULATION_ATTR
-            ),
-            # TODO: add participation rate and party correction
-        ],
+        raking_functions=create_selects_year_correctors(electorate_df),
         iterations=1000,
         clip_range=(1 / acceptable_correction, acceptable_correction),
         external_weights=external_weights,
+        checkpoints=checkpoints,
     )
 
     selects_df = selects_df.copy()
@@ -95,27 +80,60 @@ def correct_selects_year_weights(
 
 def post_process_selects(
         selects_df: pd.DataFrame,
-        electorate_df: pd.DataFrame,
+        electorate_df: pd.DataFrame | ElectorateTargets,
         acceptable_correction: float = 5.0,
         age_std: float = 3.0,
-) -> pd.DataFrame:
+        materialize: bool = True,
+        checkpoints: RakingCheckpoints = None,
+) -> pd.DataFrame | SpreadFrame:
     """
     Post-process the selects dataframe by spreading ages and correcting weights.
 
     Args:
         selects_df: The selects dataframe
-        electorate_df: The electorate dataframe
+        electorate_df: The electorate dataframe or its precomputed targets (see `get_electorate_targets`)
         acceptable_correction: Maximum allowed over- or under-weighting for correction
         age_std: Standard deviation for age spreading
+        materialize: Whether to return a DataFrame or keep the spread implicit
+        checkpoints: Optional store of previous solutions to continue from (and save to)
 
     Returns:
-        DataFrame with processed demographic weights
+        DataFrame (or implicit spread) with processed demographic weights
     """
-    selects_df = spread_age(selects_df, age_std=age_std)
+    selects_df = spread_age_frame(selects_df, age_std=age_std)
     selects_df = correct_selects_year_weights(
         selects_df=selects_df,
         electorate_df=electorate_df,
         acceptable_correction=acceptable_correction,
-        external_weights=selects_df[TOTAL_WEIGHT]
+        external_weights=selects_df[TOTAL_WEIGHT],
+        checkpoints=checkpoints,
+    )
+    return selects_df.materialize() if materialize else selects_df
+
+
+# Source files of the weighting (this module, the spreading and the raking), part of the key of cached weights,
+# so changing any of them invalidates the weights computed with the previous code
+WEIGHTING_SOURCES = tuple(dict.fromkeys(
+    inspect.getsourcefile(obj) for obj in (post_process_selects, SpreadFrame, rake_survey_weights)
+))
+
+
+@memoize(WEIGHTS_CACHE, sources=WEIGHTING_SOURCES, hash_sources=True,
+         dependencies=(get_fors_selects, get_electorate_targets))
+def get_post_processed_selects_year(
+        year: int,
+        acceptable_correction: float = 5.0,
+        age_std: float = 3.0,
+) -> SpreadFrame:
+    """
+    Post-process a single year of the Selects against its electorate, see `post_process_selects`.
+
+    The implicit spread with the raked weights is cached on disk.
+    """
+    selects_year_df = get_fors_selects(years=[year]).dropna(axis=1, how='all')
+    return post_process_selects(
+        selects_year_df, get_electorate_targets(year),
+        acceptable_correction=acceptable_correction,
+        age_std=age_std,
+        materialize=False,
     )
-    return selects_df
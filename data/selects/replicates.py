@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from data.parallel import default_processes, mapped_pool, worker_state
+from data.population_cube import ElectorateTargets
+from data.selects.columns import TOTAL_WEIGHT, AGE_WEIGHT, RESPONDENT_ID
+from data.selects.process import create_selects_year_correctors, post_process_selects
+from data.selects.spread import SpreadFrame
+from data.weights import rake_replicate_weights
+
+REPLICATE_METHODS = ('bootstrap', 'jackknife')
+
+
+def _cluster_codes(clusters: pd.Series) -> tuple[np.ndarray, int]:
+    """Cluster code of every row (rows without cluster are clusters of their own) and the number of clusters."""
+    codes, uniques = pd.factorize(clusters)
+    codes = codes.astype(np.int64)
+    is_missing = codes < 0
+    codes[is_missing] = len(uniques) + np.arange(is_missing.sum())
+    return codes, len(uniques) + int(is_missing.sum())
+
+
+def _jackknife_groups(n_clusters: int, n_replicates: int, seed: int) -> np.ndarray:
+    """Random (but deterministic) assignment of the clusters to the deleted groups of the jackknife."""
+    if n_replicates > n_clusters:
+        raise ValueError(f"Cannot build {n_replicates} jackknife replicates from {n_clusters} clusters")
+    return np.random.default_rng(seed).permutation(n_clusters) % n_replicates
+
+
+def replicate_factors(
+        cluster_codes: np.ndarray,
+        n_clusters: int,
+        replicates: range,
+        method: str = 'bootstrap',
+        seed: int = 0,
+        jackknife_groups: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Factors of every row in the given replicates, resampling whole clusters.
+
+    The bootstrap is the rescaled bootstrap of Rao and Wu: every replicate draws ``n_clusters - 1``
+    clusters with replacement (with its own seed derived from `seed` and the replicate number, so
+    replicates do not depend on how they are split up), scaled by ``n_clusters / (n_clusters - 1)``.
+    The jackknife deletes one group of clusters per replicate and scales up the others.
+
+    Returns:
+        Array of shape ``(n_rows, len(replicates))``
+    """
+    factors = np.empty((len(cluster_codes), len(replicates)))
+    for i, replicate in enumerate(replicates):
+        if method == 'bootstrap':
+            draws = np.random.default_rng([seed, replicate]).integers(0, n_clusters, n_clusters - 1)
+            cluster_factors = np.bincount(draws, minlength=n_clusters) * (n_clusters / (n_clusters - 1))
+        elif method == 'jackknife':
+            n_groups = jackknife_groups.max() + 1
+            cluster_factors = np.where(jackknife_groups == replicate, 0.0, n_groups / (n_groups - 1))
+        else:
+            raise ValueError(f"Unknown replicate method {method}, expected one of {REPLICATE_METHODS}")
+        factors[:, i] = cluster_factors[cluster_codes]
+    return factors
+
+
+@dataclass(frozen=True)
+class ReplicateWeights:
+    """
+    Full-sample weights and replicate weights of the same rows, to estimate
+    the variance of weighted statistics including the variance of the weighting itself.
+    """
+    full: np.ndarray
+    replicates: np.ndarray
+    method: str
+
+    @property
+    def n_replicates(self) -> int:
+        return self.replicates.shape[1]
+
+    def estimates(self, values: np.ndarray | pd.Series | pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Weighted means of one or more value columns (missing values are left out),
+        with the full-sample weights and with every replicate.
+
+        Returns:
+            The full-sample estimates of shape ``(n_values,)`` and the replicate estimates
+            of shape ``(n_values, n_replicates)``
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(len(self.full), -1)
+        is_valid = ~np.isnan(values)
+        values = np.where(is_valid, values, 0.0)
+        # One product for the weighted sums and valid weights of all columns, full sample and replicates
+        weights = np.column_stack((self.full, self.replicates))
+        sums = np.concatenate((values, is_valid), axis=1).T @ weights
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = sums[:values.shape[1]] / sums[values.shape[1]:]
+        return means[:, 0], means[:, 1:]
+
+    def variance(self, values: np.ndarray | pd.Series | pd.DataFrame) -> np.ndarray:
+        """Replicate variance of the weighted means of one or more value columns, see `estimates`."""
+        full, replicates = self.estimates(values)
+        squares = ((replicates - full[:, None]) ** 2).sum(axis=1)
+        if self.method == 'jackknife':
+            return squares * (self.n_replicates - 1) / self.n_replicates
+        return squares / self.n_replicates
+
+    def standard_error(self, values: np.ndarray | pd.Series | pd.DataFrame) -> np.ndarray:
+        return np.sqrt(self.variance(values))
+
+
+def _rake_replicates(replicates: range) -> np.ndarray:
+    """Final weights of some replicates: replicate factors times raked and external weights."""
+    state = worker_state
+    factors = replicate_factors(
+        state['cluster_codes'], state['n_clusters'], replicates,
+        method=state['method'], seed=state['seed'], jackknife_groups=state.get('jackknife_groups'),
+    )
+    external_weights = np.asarray(state['external_weights'])
+    raked_weights = rake_replicate_weights(
+        state['sample_df'], state['correctors'], factors,
+        iterations=1000,
+        clip_range=state['clip_range'],
+        external_weights=pd.Series(external_weights),
+    )
+    return factors * raked_weights * external_weights[:, None]
+
+
+def selects_replicate_weights(
+        selects_df: pd.DataFrame,
+        electorate_df: pd.DataFrame | ElectorateTargets,
+        n_replicates: int = 200,
+        method: str = 'bootstrap',
+        seed: int = 0,
+        acceptable_correction: float = 5.0,
+        age_std: float = 3.0,
+        processes: int = None,
+) -> tuple[SpreadFrame, ReplicateWeights]:
+    """
+    Post-process a selects year (see `post_process_selects`) together with replicate weights.
+
+    Every replicate resamples the respondents (clustered by `RESPONDENT_ID`) and redoes the raking
+    of the age spread, so the replicate variance includes the variance of the weighting. The spread
+    is the same for every replicate, only the raking is repeated: the replicates are raked as the
+    columns of one array per worker process, with deterministic per-replicate seeds.
+
+    Args:
+        selects_df: The selects dataframe of a single year
+        electorate_df: The electorate dataframe or its precomputed targets (see `get_electorate_targets`)
+        n_replicates: Number of replicates
+        method: Replicate method, see `REPLICATE_METHODS`
+        seed: Seed of the resampling
+        acceptable_correction: Maximum allowed over- or under-weighting for correction
+        age_std: Standard deviation for age spreading
+        processes: Number of worker processes (default: all but one CPU)
+
+    Returns:
+        The implicit spread with the full-sample weights and the replicate weights of its rows
+    """
+    if method not in REPLICATE_METHODS:
+        raise ValueError(f"Unknown replicate method {method}, expected one of {REPLICATE_METHODS}")
+    correctors = create_selects_year_correctors(electorate_df)
+    spread = post_process_selects(
+        selects_df, electorate_df,
+        acceptable_correction=acceptable_correction,
+        age_std=age_std,
+        materialize=False,
+    )
+
+    cluster_codes, n_clusters = _cluster_codes(selects_df[RESPONDENT_ID].reset_index(drop=True))
+    arrays = {
+        'cluster_codes': cluster_codes[spread.rows],
+        'external_weights': spread[AGE_WEIGHT].to_numpy(np.float64)
+        * spread.df[TOTAL_WEIGHT].to_numpy(np.float64, na_value=np.nan)[spread.rows],
+    }
+    if method == 'jackknife':
+        arrays['jackknife_groups'] = _jackknife_groups(n_clusters, n_replicates, seed)
+    state = {
+        'sample_df': spread.materialize(list(dict.fromkeys(
+            column for corrector in correctors for column in corrector.columns
+        ))),
+        'correctors': correctors,
+        'clip_range': (1 / acceptable_correction, acceptable_correction),
+        'n_clusters': n_clusters,
+        'method': method,
+        'seed': seed,
+    }
+
+    processes = processes or default_processes()
+    chunk_size = -(-n_replicates // processes)
+    chunks = [range(start, min(start + chunk_size, n_replicates)) for start in range(0, n_replicates, chunk_size)]
+    with mapped_pool(arrays, state, processes) as pool:
+        replicates = np.concatenate(pool.map(_rake_replicates, chunks), axis=1)
+
+    return spread, ReplicateWeights(spread[TOTAL_WEIGHT].to_numpy(np.float64), replicates, method)
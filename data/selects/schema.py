@@ -0,0 +1,93 @@
+from typing import Hashable
+
+import numpy as np
+import pandas as pd
+
+from data.selects.columns import SELECTS_COLUMN_KINDS, LABELLED_KIND, CODE_KIND, CONTINUOUS_KIND, EXACT_KIND
+
+# Nullable integer types from small to large
+_INTEGER_TYPES = ('Int8', 'Int16', 'Int32', 'Int64')
+# Strings with at most this share of unique values are stored as categoricals
+_MAX_LABEL_SHARE = 0.5
+
+
+def infer_column_kind(values: pd.Series) -> str:
+    """Compact storage kind of a column that is not declared in `SELECTS_COLUMN_KINDS`."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return LABELLED_KIND
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return EXACT_KIND
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return CODE_KIND
+    if pd.api.types.is_object_dtype(values.dtype) or pd.api.types.is_string_dtype(values.dtype):
+        return LABELLED_KIND if values.nunique() <= _MAX_LABEL_SHARE * len(values) else EXACT_KIND
+    return EXACT_KIND
+
+
+def _smallest_integer_type(values: np.ndarray) -> str:
+    low, high = (values.min(), values.max()) if len(values) else (0, 0)
+    return next(
+        integer_type for integer_type in _INTEGER_TYPES
+        if np.iinfo(integer_type.lower()).min <= low and high <= np.iinfo(integer_type.lower()).max
+    )
+
+
+def compact_column(values: pd.Series, kind: str = None) -> pd.Series:
+    """
+    Convert a column to the compact type of its kind.
+
+    Labelled columns become categoricals, codes the smallest (nullable) integer type, continuous
+    measures float32. Labelled (categorical) columns keep their labels whatever their kind, and
+    codes with fractions (e.g. weights that are not declared) are kept as they are, only declared
+    continuous measures lose precision.
+
+    Args:
+        values: The column
+        kind: The storage kind (default: inferred, see `infer_column_kind`)
+    """
+    kind = infer_column_kind(values) if kind is None else kind
+    if kind == EXACT_KIND or (kind != LABELLED_KIND and not pd.api.types.is_numeric_dtype(values.dtype)):
+        return values
+    if kind == LABELLED_KIND:
+        return values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype('category')
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return values
+
+    numbers = values.to_numpy(np.float64, na_value=np.nan)
+    known = numbers[~np.isnan(numbers)]
+    if kind == CONTINUOUS_KIND:
+        return values.astype(np.float32)
+    if np.all(np.mod(known, 1) == 0):
+        integer_type = _smallest_integer_type(known)
+        # Columns without missing values keep a plain NumPy type
+        return values.astype(integer_type if len(known) < len(numbers) else integer_type.lower())
+    return values
+
+
+def compact_selects(df: pd.DataFrame, kinds: dict[Hashable, str] = None) -> pd.DataFrame:
+    """
+    Convert all columns of a Selects DataFrame to compact types.
+
+    Args:
+        df: The Selects DataFrame
+        kinds: Storage kind of the columns (default: `SELECTS_COLUMN_KINDS`), other columns are inferred
+    """
+    kinds = SELECTS_COLUMN_KINDS if kinds is None else kinds
+    return pd.DataFrame({
+        column: compact_column(df[column], kinds.get(column)) for column in df.columns
+    }, index=df.index)
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """
+    Memory usage (in bytes) and type of every column before and after a conversion (e.g. `compact_selects`),
+    sorted by the saved memory.
+    """
+    report = pd.DataFrame({
+        'Type Before': before.dtypes.astype(str),
+        'Type After': after.dtypes.astype(str),
+        'Memory Before': before.memory_usage(index=False, deep=True),
+        'Memory After': after.memory_usage(index=False, deep=True),
+    })
+    report['Saved'] = report['Memory Before'] - report['Memory After']
+    return report.sort_values('Saved', ascending=False)
@@ -1,10 +1,17 @@
-import functools
+import shutil
+from pathlib import Path
+from typing import Collection, Hashable
 
 import numpy as np
 import pandas as pd
 
-from data.attribute import YEAR_ATTR, SEX_ATTR, AGE_ATTR, COMMUNE_SIZE_ATTR, SEX_MALE, SEX_FEMALE
+from data.attribute import CACHE_TO_ATTR_MAPPER, ATTR_TO_CACHE_MAPPER, YEAR_ATTR, SEX_ATTR, AGE_ATTR, \
+    COMMUNE_SIZE_ATTR, SEX_MALE, SEX_FEMALE
+from data.cache import SELECTS_CACHE, memoize, content_stamp
 from data.location import load_cantons_metadata, CANTON_ATTR
+from data.selects.schema import compact_selects
+
+SELECTS_FILE = 'data_raw/fors_selects_1971_2019/495_Selects_CumulativeFile_Data_1971-2019_v2.3.0.dta'
 
 SG7B_TO_COMMUNE_SIZE_MAPPER = {
     '-999': '1-999',
@@ -24,8 +31,10 @@ _SELECTS_TO_ATTR_MAPPER = {
 }
 
 
-@functools.cache
-def get_fors_selects() -> pd.DataFrame:
+# Only keyed (on the raw file, the processing code and the cantons), the year partitions are the stored result
+@memoize(SELECTS_CACHE, sources=(SELECTS_FILE,), helpers=(compact_selects,), dependencies=(load_cantons_metadata,),
+         memory=False, disk=False)
+def _load_processed_fors_selects() -> pd.DataFrame:
     cantons_metadata = load_cantons_metadata()
     canton_map = cantons_metadata.set_index(cantons_metadata.cantonAbbreviation.str.lower())[CANTON_ATTR]
     processors = {
@@ -33,14 +42,15 @@ def get_fors_selects() -> pd.DataFrame:
             'male': SEX_MALE,
             'female': SEX_FEMALE
         }),
-        'age': lambda x: x.astype(np.float16).clip(-1, 100).fillna(-1),
+        'age': lambda x: x.astype(np.float32).clip(-1, 100).fillna(-1),
         'sg3': lambda x: x.map(canton_map).astype(CANTON_ATTR.type),
         'sg4': lambda x: x.map(canton_map).astype(CANTON_ATTR.type),
         'sg2': lambda x: x.map(canton_map).astype(CANTON_ATTR.type),
         'sg7b': lambda x: x.map(SG7B_TO_COMMUNE_SIZE_MAPPER),
     }
 
-    df = pd.read_stata('data_raw/fors_selects_1971_2019/495_Selects_CumulativeFile_Data_1971-2019_v2.3.0.dta')
+    # Slow to load
+    df = pd.read_stata(SELECTS_FILE)
 
     for name, attribute in _SELECTS_TO_ATTR_MAPPER.items():
         processor = processors.get(name, lambda x: x)
@@ -50,4 +60,59 @@ def get_fors_selects() -> pd.DataFrame:
             continue
         df[name] = processor(df[name])
 
-    return df.rename(_SELECTS_TO_ATTR_MAPPER, axis=1)
+    return compact_selects(df.rename(_SELECTS_TO_ATTR_MAPPER, axis=1))
+
+
+def _to_cache_column(column: Hashable) -> str:
+    """Column name in the cache for a processed or raw Selects column (e.g. 'sg7b' or `COMMUNE_SIZE_ATTR`)."""
+    column = _SELECTS_TO_ATTR_MAPPER.get(column, column)
+    return ATTR_TO_CACHE_MAPPER.get(column, column)
+
+
+def _get_selects_partitions() -> dict[int, Path]:
+    """Feather file of every year of the processed Selects, created on first use."""
+    partitions_dir = SELECTS_CACHE.file('fors_selects', _load_processed_fors_selects.key())
+    if not partitions_dir.exists():
+        df = _load_processed_fors_selects().rename(ATTR_TO_CACHE_MAPPER, axis=1)
+        # Write to a temporary directory first to never leave an incomplete cache behind
+        tmp_dir = partitions_dir.with_name(partitions_dir.name + '.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+        for year, year_df in df.groupby(YEAR_ATTR.id, observed=True):
+            year_df.reset_index(drop=True).to_feather(tmp_dir.joinpath(f'{year}.feather'))
+        tmp_dir.rename(partitions_dir)
+    return {int(path.stem): path for path in sorted(partitions_dir.glob('*.feather'))}
+
+
+def get_selects_year_stamps() -> dict[int, str]:
+    """Content stamp of every year of the processed Selects, to find the years whose respondents changed."""
+    return {year: content_stamp(path) for year, path in _get_selects_partitions().items()}
+
+
+@memoize(SELECTS_CACHE, dependencies=(_load_processed_fors_selects,), disk=False)
+def get_fors_selects(years: Collection[int] = None, columns: Collection[Hashable] = None) -> pd.DataFrame:
+    """
+    Load the processed Selects cumulative file.
+
+    Only the requested years and columns are read from the (year-partitioned) cache.
+
+    Args:
+        years: Years to load (default: all)
+        columns: Columns to load, e.g. `SELECTS_DEMOGRAPHIC_COLUMNS` (default: all). The year is always included.
+
+    Returns:
+        DataFrame with one row per respondent and year
+    """
+    years = None if years is None else {int(year) for year in years}
+    columns = None if columns is None else list(dict.fromkeys(
+        [YEAR_ATTR.id] + [_to_cache_column(column) for column in columns]
+    ))
+    partitions = _get_selects_partitions()
+    frames = [
+        pd.read_feather(path, columns=columns)
+        for year, path in partitions.items()
+        if years is None or year in years
+    ]
+    if not frames:
+        frames = [pd.read_feather(next(iter(partitions.values())), columns=columns).iloc[:0]]
+    return pd.concat(frames, ignore_index=True).rename(CACHE_TO_ATTR_MAPPER, axis=1)
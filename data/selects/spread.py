@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+from typing import Iterable, Hashable
+
+import numpy as np
+import pandas as pd
+
+from data.attribute import AGE_ATTR
+from data.selects.columns import TOTAL_WEIGHT, AGE_WEIGHT
+
+
+class SpreadFrame:
+    """
+    Implicit (non-materialized) expansion of a respondent DataFrame.
+
+    Every expanded row points to a row of the untouched original DataFrame. Only the
+    columns that differ per expanded row (e.g. spread age and weights) are stored as
+    compact arrays, all other columns are gathered from the original when accessed.
+    Supports the subset of the DataFrame API used by the weighting code
+    (column access, assignment, `copy`, `groupby`).
+    """
+
+    def __init__(self, df: pd.DataFrame, rows: np.ndarray, expanded: dict[Hashable, np.ndarray]):
+        self.df = df
+        self.rows = rows
+        self._expanded = expanded
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def index(self) -> pd.RangeIndex:
+        return pd.RangeIndex(len(self.rows))
+
+    @property
+    def columns(self) -> pd.Index:
+        return self.df.columns.append(pd.Index([
+            column for column in self._expanded if column not in self.df.columns
+        ], dtype=object))
+
+    def __getitem__(self, column: Hashable) -> pd.Series:
+        if column in self._expanded:
+            return pd.Series(self._expanded[column], name=column)
+        return pd.Series(self.df[column].array.take(self.rows), name=column)
+
+    def __setitem__(self, column: Hashable, values: pd.Series | np.ndarray):
+        values = np.asarray(values)
+        if len(values) != len(self.rows):
+            raise ValueError(f"Length mismatch: {len(values)} values for {len(self.rows)} rows")
+        self._expanded[column] = values
+
+    def copy(self) -> SpreadFrame:
+        """Shallow copy sharing the original DataFrame and row mapping."""
+        return SpreadFrame(self.df, self.rows, dict(self._expanded))
+
+    def _respondent_sums(self, weights_col: Hashable) -> tuple[np.ndarray, np.ndarray]:
+        """Positions of the original rows that appear in the expansion and their summed weights."""
+        sums = np.bincount(self.rows, weights=self[weights_col].to_numpy(np.float64), minlength=len(self.df))
+        positions = np.flatnonzero(np.bincount(self.rows, minlength=len(self.df)))
+        return positions, sums[positions]
+
+    def respondent_weights(self, weights_col: Hashable = TOTAL_WEIGHT) -> pd.Series:
+        """Sum of the expanded weights for every original row that appears in the expansion."""
+        positions, sums = self._respondent_sums(weights_col)
+        return pd.Series(sums, index=self.df.index[positions], name=weights_col)
+
+    def weighted_sum(self, by: Hashable | list, weights_col: Hashable = TOTAL_WEIGHT,
+                     dropna: bool = False) -> pd.Series:
+        """
+        Sum of the weights per group, equivalent to
+        ``materialize().groupby(by, observed=True, dropna=dropna)[weights_col].sum()``.
+
+        Groups by non-expanded columns are summed per original row first, so nothing is gathered.
+        """
+        by = by if isinstance(by, list) else [by]
+        if any(column in self._expanded for column in by):
+            return self.groupby(by, observed=True, dropna=dropna)[weights_col].sum()
+        positions, sums = self._respondent_sums(weights_col)
+        keys = self.df[by].iloc[positions].reset_index(drop=True)
+        return pd.Series(sums, name=weights_col).groupby(
+            [keys[column] for column in by] if len(by) > 1 else keys[by[0]],
+            observed=True, dropna=dropna
+        ).sum()
+
+    def groupby(self, by: Hashable | list, **kwargs):
+        """Group a DataFrame gathered with only the grouping and expanded columns."""
+        columns = list(dict.fromkeys((by if isinstance(by, list) else [by]) + list(self._expanded)))
+        return self.materialize(columns).groupby(by, **kwargs)
+
+    def materialize(self, columns: Iterable[Hashable] = None) -> pd.DataFrame:
+        """Gather the expanded rows into a DataFrame (all columns by default)."""
+        columns = list(self.columns if columns is None else columns)
+        base_columns = [column for column in columns if column in self.df.columns]
+        df = self.df[base_columns].iloc[self.rows].reset_index(drop=True)
+        for column in columns:
+            if column in self._expanded:
+                df[column] = self._expanded[column]
+        return df
+
+
+def spread_age_frame(
+        df: pd.DataFrame,
+        age_std: float = 3.0,
+        min_age: int = 18,
+        max_age: int = 100,
+        kernel_size_std: float = 4,
+) -> SpreadFrame:
+    """
+    Spread every respondent to multiple ages and weight using a Gaussian kernel,
+    without duplicating the DataFrame.
+    """
+    # Offsets and raw Gaussian weights for candidates.
+    kernel_radius = int(np.ceil(kernel_size_std * age_std))
+    offsets = np.arange(-kernel_radius, kernel_radius + 1)
+    kernel = np.exp(-0.5 * (offsets / age_std) ** 2)
+
+    # Create candidate rows, ages and corresponding weights.
+    candidate_ages = (df[AGE_ATTR].to_numpy(np.int64)[:, None] + offsets).ravel()
+    candidate_rows = np.repeat(np.arange(len(df), dtype=np.int32), len(offsets))
+    candidate_weights = np.tile(kernel, len(df))
+
+    # Keep only candidates within the allowed age range.
+    valid = (candidate_ages >= min_age) & (candidate_ages <= max_age)
+    rows = candidate_rows[valid]
+    age_weights = candidate_weights[valid]
+
+    # Normalize and update weights
+    age_weights /= age_weights.mean()
+    return SpreadFrame(df, rows, {
+        AGE_ATTR: candidate_ages[valid].astype(AGE_ATTR.type),
+        AGE_WEIGHT: age_weights,
+        TOTAL_WEIGHT: df[TOTAL_WEIGHT].to_numpy(np.float64, na_value=np.nan)[rows] * age_weights,
+    })
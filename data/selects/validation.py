@@ -0,0 +1,208 @@
+from typing import Iterator, Hashable
+
+import numpy as np
+import pandas as pd
+
+from data.attribute import AGE_ATTR
+from data.encoding import encode_column, with_missing
+from data.parallel import mapped_pool, worker_state
+from data.selects.columns import TOTAL_WEIGHT, AGE_WEIGHT
+from data.selects.process import correct_selects_year_weights, create_selects_year_correctors
+from data.selects.spread import spread_age_frame
+from data.weights import rake_survey_weights
+
+
+def age_holdout_windows(ages: pd.Series, radius: int = 2, min_sample: int = 30) -> list[tuple[int, int]]:
+    """
+    Age windows ``(start, end)`` (inclusive) centered on every age, keeping only those
+    with at least `min_sample` respondents.
+    """
+    ages = ages.to_numpy()
+    counts = np.bincount(ages - ages.min(), minlength=ages.max() - ages.min() + 1)
+    cumulative = np.concatenate(([0], np.cumsum(counts)))
+    windows = []
+    for center in range(ages.min(), ages.max() + 1):
+        start, end = center - radius, center + radius
+        in_window = cumulative[min(end, ages.max()) - ages.min() + 1] - cumulative[max(start, ages.min()) - ages.min()]
+        if in_window >= min_sample:
+            windows.append((start, end))
+    return windows
+
+
+def _attribute_distributions(rows: np.ndarray, weights: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Weights and counts of all categories of all attributes for the given respondent rows."""
+    codes = worker_state['attribute_codes'][rows]
+    n_codes = worker_state['attribute_offsets'][-1]
+    return (
+        np.bincount(codes.ravel(), weights=np.repeat(weights, codes.shape[1]), minlength=n_codes),
+        np.bincount(codes.ravel(), minlength=n_codes),
+    )
+
+
+def _run_fold(window: tuple[int, int]) -> list[dict]:
+    """Hold out a window of ages, rebuild it from the other ages and compare the attribute distributions."""
+    state = worker_state
+    window_start, window_end = window
+    ages = state['ages']
+    is_holdout = (ages >= window_start) & (ages <= window_end)
+
+    # Spread and correct the training respondents (starting from the global solution, if warm started)
+    training_rows = np.flatnonzero(~is_holdout)
+    spread = spread_age_frame(
+        pd.DataFrame({AGE_ATTR: ages[training_rows], TOTAL_WEIGHT: 1.0}),
+        **state['spread_params']
+    )
+    spread_rows = training_rows[spread.rows]
+    spread_ages = spread[AGE_ATTR].to_numpy()
+    spread_codes = tuple(state[f'codes_{i}'][spread_rows] for i in range(len(state['raking_columns'])))
+    fold_df = pd.DataFrame({AGE_ATTR: spread_ages} | {
+        column: labels.array.take(codes)
+        for (column, labels), codes in zip(state['raking_columns'], spread_codes)
+    })
+    raked_weights = rake_survey_weights(
+        fold_df, state['correctors'],
+        iterations=1000,
+        clip_range=state['clip_range'],
+        external_weights=spread[AGE_WEIGHT],
+        initial_weights=None if state['warm_start'] is None else
+        pd.Series(state['warm_start'][(spread_ages,) + spread_codes]),
+    )
+
+    # Compare the proxy respondents generated for the window with the held out ones
+    is_proxy = (spread_ages >= window_start) & (spread_ages <= window_end)
+    proxy_weights, proxy_counts = _attribute_distributions(
+        spread_rows[is_proxy], (spread[AGE_WEIGHT] * raked_weights).to_numpy()[is_proxy]
+    )
+    holdout_rows = np.flatnonzero(is_holdout)
+    actual_weights, actual_counts = _attribute_distributions(holdout_rows, state['weights'][holdout_rows])
+
+    results = []
+    offsets = state['attribute_offsets']
+    for i in range(len(offsets) - 1):
+        category_slice = slice(offsets[i], offsets[i + 1])
+        actual, proxy = actual_weights[category_slice], proxy_weights[category_slice]
+        actual_count, proxy_count = actual_counts[category_slice], proxy_counts[category_slice]
+        # Skip attributes missing entirely (last category is the missing value)
+        if actual_count[:-1].sum() == 0 or proxy_count[:-1].sum() == 0:
+            continue
+        # Ignore missing values if they make up more than 50%
+        if actual[-1] > actual.sum() / 2 and proxy[-1] > proxy.sum() / 2:
+            actual, proxy, actual_count, proxy_count = actual[:-1], proxy[:-1], actual_count[:-1], proxy_count[:-1]
+        if actual.sum() == 0 or proxy.sum() == 0:
+            continue
+        # Like `total_variance_distance` of the two aligned distributions, categories only observed
+        # on one side are left out (after normalizing every side by its own total)
+        is_shared = (actual_count > 0) & (proxy_count > 0)
+        results.append({
+            'window_start': window_start,
+            'window_end': window_end,
+            'age_center': (window_start + window_end) / 2,
+            'attribute': i,
+            'tvd': 0.5 * np.abs(actual / actual.sum() - proxy / proxy.sum())[is_shared].sum(),
+            'holdout_count': len(holdout_rows),
+        })
+    return results
+
+
+def iter_age_holdout(
+        selects_df: pd.DataFrame,
+        electorate_df: pd.DataFrame,
+        attributes: list[Hashable],
+        windows: list[tuple[int, int]],
+        acceptable_correction: float = 5.0,
+        age_std: float = 3.0,
+        warm_start: bool = False,
+        processes: int = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Holdout validation of age spreading, yielding the results of every window as it finishes.
+
+    For every age window ``(start, end)`` (inclusive), the respondents within are held out,
+    the others are spread and corrected, and the spread proxies within the window are compared
+    to the held out respondents (with globally corrected weights) by the TVD of every attribute,
+    over the categories observed in both (as `total_variance_distance` of the two distributions).
+
+    The respondent arrays are encoded once and shared with the worker processes as
+    memory-mapped files.
+
+    Args:
+        selects_df: The selects dataframe of a single year
+        electorate_df: The electorate dataframe of the same year
+        attributes: The columns to compare
+        windows: The age windows to hold out, see `age_holdout_windows`
+        acceptable_correction: Maximum allowed over- or under-weighting for correction
+        age_std: Standard deviation for age spreading
+        warm_start: Whether every window starts raking from the global spread solution instead of
+            from scratch (faster, but with clipped weights it can settle on a different solution)
+        processes: Number of worker processes (default: all but one CPU)
+
+    Returns:
+        Iterator of DataFrames with the TVD per window and attribute
+    """
+    clip_range = (1 / acceptable_correction, acceptable_correction)
+    correctors = create_selects_year_correctors(electorate_df)
+    selects_df = selects_df.reset_index(drop=True)
+
+    # Global weights for the held out respondents
+    corrected_weights = correct_selects_year_weights(selects_df, electorate_df, acceptable_correction)[TOTAL_WEIGHT]
+
+    arrays = {
+        'ages': selects_df[AGE_ATTR].to_numpy(np.int16),
+        'weights': corrected_weights.to_numpy(np.float64),
+    }
+    # Codes of the (non-spread) raking columns, the warm start is looked up by age and these codes
+    raking_columns = []
+    for column in dict.fromkeys(column for corrector in correctors for column in corrector.columns):
+        if column != AGE_ATTR:
+            arrays[f'codes_{len(raking_columns)}'], uniques = encode_column(selects_df[column])
+            raking_columns.append((column, with_missing(uniques)))
+
+    warm_start_weights = None
+    if warm_start:
+        spread = spread_age_frame(selects_df, age_std=age_std)
+        spread_weights = rake_survey_weights(
+            spread, correctors,
+            iterations=1000,
+            clip_range=clip_range,
+            external_weights=spread[AGE_WEIGHT],
+        )
+        # The last entry of every code axis is for missing values
+        warm_start_weights = np.ones(
+            (spread[AGE_ATTR].max() + 1,) + tuple(len(labels) for _, labels in raking_columns)
+        )
+        warm_start_weights[(spread[AGE_ATTR].to_numpy(),) + tuple(
+            arrays[f'codes_{i}'][spread.rows] for i in range(len(raking_columns))
+        )] = spread_weights.to_numpy()
+
+    # Attribute codes, offset so that all categories of all attributes are distinct
+    # (the last category of every attribute is for missing values)
+    attribute_codes = []
+    attribute_offsets = [0]
+    for attribute in attributes:
+        codes, uniques = encode_column(selects_df[attribute])
+        attribute_codes.append(codes + attribute_offsets[-1])
+        attribute_offsets.append(attribute_offsets[-1] + len(uniques) + 1)
+    arrays['attribute_codes'] = np.column_stack(attribute_codes) if attributes else \
+        np.zeros((len(selects_df), 0), dtype=np.int32)
+    attribute_offsets = np.array(attribute_offsets)
+
+    state = {
+        'spread_params': {'age_std': age_std},
+        'raking_columns': raking_columns,
+        'correctors': correctors,
+        'clip_range': clip_range,
+        'warm_start': warm_start_weights,
+        'attribute_offsets': attribute_offsets,
+    }
+    with mapped_pool(arrays, state, processes) as pool:
+        for fold_results in pool.imap_unordered(_run_fold, windows):
+            fold_df = pd.DataFrame(fold_results, columns=[
+                'window_start', 'window_end', 'age_center', 'attribute', 'tvd', 'holdout_count'
+            ])
+            fold_df['attribute'] = [attributes[i] for i in fold_df['attribute']]
+            yield fold_df
+
+
+def run_age_holdout(*args, **kwargs) -> pd.DataFrame:
+    """Run `iter_age_holdout` to completion and combine the results."""
+    return pd.concat(list(iter_age_holdout(*args, **kwargs)), ignore_index=True)
@@ -1,6 +1,161 @@
+from __future__ import annotations
+
+import pickle
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
 import pandas as pd
 import numpy as np
-from typing import List, Callable, Tuple
+from typing import List, Callable, Tuple, Dict
+
+from data.cache import Cache, fingerprint
+from data.encoding import encode_column
+
+# Array-level corrector: maps the current (externally weighted) weights to correction factors.
+ArrayCorrector = Callable[[np.ndarray], np.ndarray]
+
+
+def _as_weights_array(weights: pd.Series | np.ndarray) -> np.ndarray:
+    """Convert weights to a contiguous float64 array, treating missing weights as zero (like pandas sums)."""
+    weights = np.ascontiguousarray(weights, dtype=np.float64)
+    return np.where(np.isnan(weights), 0.0, weights)
+
+
+def _align_weights(weights: pd.Series, index: pd.Index) -> np.ndarray:
+    """Align a weights Series to an index and convert it to an array."""
+    if not weights.index.equals(index):
+        weights = weights.reindex(index)
+    return _as_weights_array(weights.to_numpy(dtype=np.float64, na_value=np.nan))
+
+
+def _bincount(codes: np.ndarray, weights: np.ndarray, minlength: int) -> np.ndarray:
+    """
+    Sums of the weights per code, for 1-D weights or for every column of 2-D weights
+    (one column per replicate, the result has the codes along the first axis).
+    """
+    if weights.ndim == 1:
+        return np.bincount(codes, weights=weights, minlength=minlength)
+    n_columns = weights.shape[1]
+    keys = (codes[:, None] * n_columns + np.arange(n_columns)).ravel()
+    return np.bincount(
+        keys, weights=np.ascontiguousarray(weights).ravel(), minlength=minlength * n_columns
+    ).reshape(minlength, n_columns)
+
+
+def _as_column(values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Reshape per-row (or per-group) values to broadcast against 1-D or 2-D weights."""
+    return values.reshape(values.shape + (1,) * (weights.ndim - 1))
+
+
+def _with_neutral(factors: np.ndarray) -> np.ndarray:
+    """Append the neutral factor for missing values (code ``len(uniques)``), see `encode_column`."""
+    return np.concatenate((factors, np.ones((1,) + factors.shape[1:])))
+
+
+def _corrector_columns(raking_functions: List[Corrector]) -> List[str]:
+    return list(dict.fromkeys(column for func in raking_functions for column in func.columns))
+
+
+def _collapse_cells(
+        sample_df: pd.DataFrame,
+        columns: List[str],
+        initial_weights: np.ndarray = None,
+) -> Tuple[np.ndarray, pd.DataFrame, np.ndarray]:
+    """
+    Collapse the sample to the unique combinations (cells) of the given columns
+    (and initial weights, if given).
+
+    Returns:
+        The cell ID of every sample row, a DataFrame with one row per cell and
+        the position of the first sample row of every cell.
+    """
+    cell_ids = np.zeros(len(sample_df), dtype=np.intp)
+    values = {column: sample_df[column] for column in columns}
+    keys = list(values.values()) + ([] if initial_weights is None else [pd.Series(initial_weights)])
+    for key in keys:
+        codes, uniques = encode_column(key)
+        # Re-compress after every key so the combined IDs cannot overflow
+        cell_ids, _ = pd.factorize(cell_ids * (len(uniques) + 1) + codes)
+    # Cell IDs are numbered in order of appearance, so a new cell starts where the running maximum grows
+    first_rows = np.flatnonzero(np.diff(np.maximum.accumulate(cell_ids), prepend=-1) > 0)
+    return cell_ids, pd.DataFrame({
+        column: column_values.iloc[first_rows].reset_index(drop=True)
+        for column, column_values in values.items()
+    }), first_rows
+
+
+class Corrector(ABC):
+    """
+    A raking function that can be compiled against a sample into an array-level corrector.
+
+    Compiled correctors accept 1-D weights or 2-D weights with one column per replicate
+    (see `rake_replicate_weights`), every column is corrected independently.
+
+    Calling the corrector directly keeps the plain ``(df, weights) -> factors`` API.
+    The correction factors may only depend on the values in `columns`.
+    """
+    columns: Tuple[str, ...]
+
+    @abstractmethod
+    def compile(self, sample_df: pd.DataFrame) -> ArrayCorrector:
+        """Precompute everything that only depends on the sample and return an array-level corrector."""
+
+    @abstractmethod
+    def fingerprint(self) -> str:
+        """Hash of the correction targets (independent of the sample)."""
+
+    def __call__(self, df: pd.DataFrame, weights: pd.Series) -> pd.Series:
+        return pd.Series(self.compile(df)(_align_weights(weights, df.index)), index=df.index)
+
+
+class MarginalCorrector(Corrector):
+    """Rakes the weighted distribution of a sample column to a target distribution."""
+
+    def __init__(self, sample_col: str, target_dist: pd.Series, target_total: float):
+        self.sample_col = sample_col
+        self.columns = (sample_col,)
+        self.target_dist = target_dist
+        self.target_total = target_total
+
+    def fingerprint(self) -> str:
+        return fingerprint(
+            type(self).__name__, self.sample_col,
+            self.target_dist.index, self.target_dist, float(self.target_total)
+        )
+
+    def compile(self, sample_df: pd.DataFrame) -> ArrayCorrector:
+        codes, uniques = encode_column(sample_df[self.sample_col])
+        n_groups = len(uniques)
+        target_share = (self.target_dist / self.target_total).reindex(uniques).to_numpy(np.float64, na_value=np.nan)
+
+        def corrector(weights: np.ndarray) -> np.ndarray:
+            current_dist = _bincount(codes, weights, n_groups + 1)[:n_groups]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                group_factors = (_as_column(target_share, weights) * weights.sum(axis=0)) / current_dist
+            # Trailing entry stays neutral for missing sample values
+            return _with_neutral(np.where(np.isnan(group_factors), 1.0, group_factors))[codes]
+
+        return corrector
+
+
+class _CallableCorrector(Corrector):
+    """Adapter for plain ``(df, weights) -> factors`` raking functions."""
+
+    def __init__(self, func: Callable[[pd.DataFrame, pd.Series], pd.Series]):
+        self.func = func
+        self.columns = ()
+
+    def fingerprint(self) -> str:
+        raise TypeError('Plain raking functions cannot be fingerprinted.')
+
+    def compile(self, sample_df: pd.DataFrame) -> ArrayCorrector:
+        def corrector(weights: np.ndarray) -> np.ndarray:
+            if weights.ndim > 1:
+                raise TypeError('Plain raking functions cannot rake replicates.')
+            factors = self.func(sample_df, pd.Series(weights, index=sample_df.index))
+            return factors.fillna(1.0).to_numpy(np.float64)
+
+        return corrector
 
 
 def create_marginal_corrector(
@@ -8,39 +163,175 @@ def create_marginal_corrector(
         population_df: pd.DataFrame,
         pop_col: str,
         pop_weight_col: str
-) -> Callable[[pd.DataFrame, pd.Series], pd.Series]:
+) -> MarginalCorrector:
     """
     Factory to create a raking function for a standard marginal distribution.
     """
     pop_total = population_df[pop_weight_col].sum()
     target_dist = population_df.groupby(pop_col, observed=True)[pop_weight_col].sum()
+    return MarginalCorrector(sample_col, target_dist, pop_total)
+
+
+class RateCorrector(Corrector):
+    """
+    Rakes weighted rates (averages of 0/1 columns) per group to target rates.
+
+    Rows counting towards a rate are scaled by ``target / current`` and the other rows of
+    the group by ``(1 - target) / (1 - current)``, so group totals stay unchanged. Several
+    rate columns are corrected one after another within a single call.
+    """
+
+    def __init__(self, grouping_col: str, target_rates: Dict[str, pd.Series]):
+        self.grouping_col = grouping_col
+        self.target_rates = target_rates
+        self.columns = (grouping_col,) + tuple(target_rates)
 
-    def corrector(df: pd.DataFrame, weights: pd.Series) -> pd.Series:
-        current_dist = weights.groupby(df[sample_col], observed=True).sum()
-        scaled_target = (target_dist / pop_total) * weights.sum()
-        factors = scaled_target / current_dist
-        return df[sample_col].map(factors).astype(float)
+    def fingerprint(self) -> str:
+        return fingerprint(type(self).__name__, self.grouping_col, *(
+            value
+            for rate_col, target_rates in self.target_rates.items()
+            for value in (rate_col, target_rates.index, target_rates)
+        ))
 
-    return corrector
+    def compile(self, sample_df: pd.DataFrame) -> ArrayCorrector:
+        codes, uniques = encode_column(sample_df[self.grouping_col])
+        n_groups = len(uniques)
+        rates = []
+        for rate_col, target_rates in self.target_rates.items():
+            values = sample_df[rate_col].astype('Float64').to_numpy(np.float64, na_value=np.nan)
+            is_valid = ~np.isnan(values)
+            rates.append((
+                np.where(is_valid, values, 0.0),
+                is_valid.astype(np.float64),
+                target_rates.reindex(uniques).to_numpy(np.float64, na_value=np.nan),
+            ))
+
+        def corrector(weights: np.ndarray) -> np.ndarray:
+            total_factors = np.ones(weights.shape)
+            for values, is_valid, target in rates:
+                values, is_valid = _as_column(values, weights), _as_column(is_valid, weights)
+                rated_dist = _bincount(codes, weights * values, n_groups + 1)[:n_groups]
+                valid_dist = _bincount(codes, weights * is_valid, n_groups + 1)[:n_groups]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    current_rates = rated_dist / valid_dist
+                    rated_factors = _as_column(target, weights) / current_rates
+                    unrated_factors = (1 - _as_column(target, weights)) / (1 - current_rates)
+                # Groups without a target or that cannot be corrected stay untouched
+                is_correctable = np.isfinite(rated_factors) & np.isfinite(unrated_factors)
+                rated_factors = _with_neutral(np.where(is_correctable, rated_factors, 1.0))[codes]
+                unrated_factors = _with_neutral(np.where(is_correctable, unrated_factors, 1.0))[codes]
+                factors = values * rated_factors + (is_valid - values) * unrated_factors + (1 - is_valid)
+                total_factors *= factors
+                weights = weights * factors
+            return total_factors
+
+        return corrector
 
 
 def create_rate_corrector(
         grouping_col: str,
         rate_col: str,
         target_rates: pd.Series
-) -> Callable[[pd.DataFrame, pd.Series], pd.Series]:
+) -> RateCorrector:
     """
     Factory to create a raking function for correcting a weighted average (rate).
     """
+    return RateCorrector(grouping_col, {rate_col: target_rates})
 
-    def corrector(df: pd.DataFrame, weights: pd.Series) -> pd.Series:
-        current_rates = df.groupby(grouping_col, observed=True).apply(
-            lambda x: np.average(x[rate_col], weights=weights.loc[x.index])
-        )
-        factors = target_rates / current_rates
-        return df[grouping_col].map(factors).astype(float)
 
-    return corrector
+def create_multi_rate_corrector(
+        grouping_col: str,
+        target_rates: Dict[str, pd.Series]
+) -> RateCorrector:
+    """
+    Factory to create a raking function for correcting multiple weighted averages (rates)
+    per group, e.g. turnout and party shares per canton.
+
+    Args:
+        grouping_col: The column to group the sample by
+        target_rates: Target rates per group, keyed by the 0/1 sample column they apply to
+    """
+    return RateCorrector(grouping_col, dict(target_rates))
+
+
+def raking_fingerprints(
+        sample_df: pd.DataFrame,
+        raking_functions: List[Corrector],
+        clip_range: Tuple[float, float],
+        external_weights: pd.Series = None,
+) -> Tuple[str, str]:
+    """
+    Fingerprints of a raking run.
+
+    Returns:
+        Hash of the sample (corrected columns and external weights) and hash of
+        the targets (correctors and clip range).
+    """
+    sample_values = [sample_df[column] for column in _corrector_columns(raking_functions)]
+    if external_weights is not None:
+        sample_values.append(pd.Series(_align_weights(external_weights, sample_df.index)))
+    return (
+        fingerprint(len(sample_df), *sample_values),
+        fingerprint(tuple(clip_range), *(func.fingerprint() for func in raking_functions)),
+    )
+
+
+@dataclass(frozen=True)
+class RakingCheckpoint:
+    """
+    Raked weights of a previous run per cell (unique combination of the corrected columns).
+
+    Can be used as initial weights for any sample with the same columns,
+    rows of unknown cells start from 1.
+    """
+    sample_fingerprint: str
+    target_fingerprint: str
+    cells: pd.MultiIndex
+    weights: np.ndarray
+
+    def initial_weights(self, sample_df: pd.DataFrame) -> pd.Series:
+        positions = self.cells.get_indexer(pd.MultiIndex.from_arrays([
+            sample_df[column] for column in self.cells.names
+        ]))
+        return pd.Series(np.where(positions >= 0, self.weights[positions], 1.0), index=sample_df.index)
+
+
+class RakingCheckpoints:
+    """
+    Store of raking checkpoints by sample and target fingerprints, kept in memory
+    and also on disk if a cache is given.
+    """
+
+    def __init__(self, cache: Cache = None):
+        self.cache = cache
+        self._checkpoints: Dict[Tuple[str, str], RakingCheckpoint] = {}
+        if cache is not None:
+            for file in sorted(cache.dir().glob('*.pkl'), key=lambda path: path.stat().st_mtime):
+                checkpoint = pickle.loads(file.read_bytes())
+                self._checkpoints[(checkpoint.sample_fingerprint, checkpoint.target_fingerprint)] = checkpoint
+
+    def put(self, checkpoint: RakingCheckpoint):
+        key = (checkpoint.sample_fingerprint, checkpoint.target_fingerprint)
+        # Re-insert to keep the most recent checkpoint last
+        self._checkpoints.pop(key, None)
+        self._checkpoints[key] = checkpoint
+        if self.cache is not None:
+            self.cache.dir().joinpath(f'{key[0]}_{key[1]}.pkl').write_bytes(pickle.dumps(checkpoint))
+
+    def find(self, sample_fingerprint: str, target_fingerprint: str) -> RakingCheckpoint | None:
+        """
+        Find the best checkpoint to continue from: the same run, else the most recent run
+        with the same targets, else the most recent run with the same sample.
+        """
+        exact = self._checkpoints.get((sample_fingerprint, target_fingerprint))
+        if exact is not None:
+            return exact
+        checkpoints = list(reversed(self._checkpoints.values()))
+        return next((
+            checkpoint for checkpoint in checkpoints if checkpoint.target_fingerprint == target_fingerprint
+        ), next((
+            checkpoint for checkpoint in checkpoints if checkpoint.sample_fingerprint == sample_fingerprint
+        ), None))
 
 
 def rake_survey_weights(
@@ -49,7 +340,9 @@ def rake_survey_weights(
         iterations: int = 100,
         clip_range: Tuple[float, float] = (0.2, 5.0),
         external_weights: pd.Series = None,
-        tolerance: float = 1e-7
+        tolerance: float = 1e-7,
+        initial_weights: pd.Series | RakingCheckpoint = None,
+        checkpoints: RakingCheckpoints = None,
 ) -> pd.Series:
     """
     Performs iterative weighting (raking) and returns the final weights.
@@ -57,49 +350,192 @@ def rake_survey_weights(
     Includes an early exit if the mean of absolute weight changes between
     iterations falls below a specified tolerance.
 
+    If all raking functions are `Corrector`s (e.g. from `create_marginal_corrector`),
+    the sample is collapsed once to the unique combinations of the corrected
+    columns and every iteration only runs NumPy operations on those cells.
+    Plain raking functions are still supported but are called with pandas
+    objects for every row on every iteration.
+
     Args:
         sample_df: The DataFrame containing the survey sample data (read-only).
+            Can also be a `SpreadFrame` if all raking functions are `Corrector`s.
         raking_functions: A list of functions. Each function must accept a
             DataFrame and a weights Series and return correction factors.
         iterations: The maximum number of raking iterations to perform.
         clip_range: A tuple (min, max) for clipping the final weights.
         external_weights: Optional Series of external weights to consider
             while correcting. Meaning final weights must be multiplied by
-            these external weights to get the final weights.
+            these external weights to get the final weights. Missing external
+            weights count as zero.
         tolerance: The convergence threshold. If the mean of absolute
             differences in weights between iterations is less than this
             value, the loop will terminate early.
+        initial_weights: Optional Series of weights or checkpoint of a previous
+            (similar) run to start raking from instead of all ones.
+        checkpoints: Optional checkpoint store to continue from the best matching
+            previous run (unless initial weights are given) and to save this run to.
+            Requires all raking functions to be `Corrector`s.
 
     Returns:
         A pandas Series containing the final calculated weights, with the same
         index as `sample_df`.
     """
-    # Initialize a local Series for weights, indexed identically to the sample DataFrame.
-    weights = pd.Series(1.0, index=sample_df.index)
+    if checkpoints is not None:
+        fingerprints = raking_fingerprints(sample_df, raking_functions, clip_range, external_weights)
+        if initial_weights is None:
+            initial_weights = checkpoints.find(*fingerprints)
+    if isinstance(initial_weights, RakingCheckpoint):
+        initial_weights = initial_weights.initial_weights(sample_df)
+    initial = None if initial_weights is None else _align_weights(initial_weights, sample_df.index)
+    if all(isinstance(func, Corrector) for func in raking_functions):
+        # Rows with the same values in all corrector columns always get the same weight,
+        # so it suffices to rake the (much smaller) table of unique cells.
+        columns = _corrector_columns(raking_functions)
+        cell_ids, cells_df, first_rows = _collapse_cells(sample_df, columns, initial)
+        correctors = [func.compile(cells_df) for func in raking_functions]
+    else:
+        cell_ids = first_rows = np.arange(len(sample_df))
+        correctors = [
+            (func if isinstance(func, Corrector) else _CallableCorrector(func)).compile(sample_df)
+            for func in raking_functions
+        ]
 
-    for i in range(iterations):
-        # Store a copy of the weights from the start of the iteration
-        prev_weights = weights.copy()
+    n_cells = cell_ids.max(initial=-1) + 1
+    external = np.ones(len(sample_df)) if external_weights is None else \
+        _align_weights(external_weights, sample_df.index)
+    cell_weights = _rake_cells(
+        correctors,
+        cell_counts=np.bincount(cell_ids, minlength=n_cells).astype(np.float64),
+        cell_external_weights=np.bincount(cell_ids, weights=external, minlength=n_cells),
+        iterations=iterations,
+        clip_range=clip_range,
+        tolerance=tolerance,
+        initial_weights=None if initial is None else initial[first_rows],
+    )
 
-        for corrector_func in raking_functions:
-            # If constant weights are provided, apply them to the current weights.
-            input_weights = weights if external_weights is None else external_weights * weights
+    if checkpoints is not None:
+        cells = pd.MultiIndex.from_frame(cells_df)
+        is_first = ~cells.duplicated()
+        checkpoints.put(RakingCheckpoint(*fingerprints, cells[is_first], cell_weights[is_first]))
+    return pd.Series(cell_weights[cell_ids], index=sample_df.index)
 
-            # Pass the original df (as read-only) and the current state of our local weights
-            correction_factors = corrector_func(sample_df, input_weights)
 
-            # Update the local weights Series
-            weights *= correction_factors.fillna(1.0)
+def rake_replicate_weights(
+        sample_df: pd.DataFrame,
+        raking_functions: List[Corrector],
+        replicate_factors: np.ndarray,
+        iterations: int = 100,
+        clip_range: Tuple[float, float] = (0.2, 5.0),
+        external_weights: pd.Series = None,
+        tolerance: float = 1e-7,
+) -> np.ndarray:
+    """
+    Rake many replicates of a sample at once, as the columns of one weights array.
 
-        # Clip and renormalize the weights
-        weights = weights.clip(lower=clip_range[0], upper=clip_range[1])
-        mean_weight = weights.mean()
-        if mean_weight > 0:
-            weights /= mean_weight
+    Every replicate reweights the sample rows by a column of `replicate_factors`
+    (e.g. how often a row is drawn in a bootstrap resample, zero for deleted rows),
+    which counts like duplicated rows in the raking, see `rake_survey_weights`.
 
-        # Maybe early exit
-        change = (weights - prev_weights).abs().mean()
-        if change < tolerance:
-            break
+    Args:
+        sample_df: The DataFrame containing the survey sample data (read-only).
+        raking_functions: The correctors to rake with (plain raking functions are not supported).
+        replicate_factors: Array of shape ``(n_rows, n_replicates)`` with the factor of every row in every replicate.
+        iterations: The maximum number of raking iterations to perform.
+        clip_range: A tuple (min, max) for clipping the final weights.
+        external_weights: Optional Series of external weights to consider while correcting.
+        tolerance: The convergence threshold (for every replicate).
+
+    Returns:
+        Array of shape ``(n_rows, n_replicates)`` with the raked weights of every replicate
+        (to be multiplied by the replicate factors and external weights for the final weights).
+    """
+    if not all(isinstance(func, Corrector) for func in raking_functions):
+        raise TypeError('Replicates can only be raked with correctors.')
+    replicate_factors = np.asarray(replicate_factors, dtype=np.float64)
+    if replicate_factors.ndim != 2 or len(replicate_factors) != len(sample_df):
+        raise ValueError(f"Replicate factors of shape {replicate_factors.shape} for {len(sample_df)} rows")
+
+    cell_ids, cells_df, _ = _collapse_cells(sample_df, _corrector_columns(raking_functions))
+    correctors = [func.compile(cells_df) for func in raking_functions]
+    n_cells = cell_ids.max(initial=-1) + 1
+    external = np.ones(len(sample_df)) if external_weights is None else \
+        _align_weights(external_weights, sample_df.index)
+    cell_weights = _rake_cells(
+        correctors,
+        cell_counts=_bincount(cell_ids, replicate_factors, n_cells),
+        cell_external_weights=_bincount(cell_ids, external[:, None] * replicate_factors, n_cells),
+        iterations=iterations,
+        clip_range=clip_range,
+        tolerance=tolerance,
+    )
+    return cell_weights[cell_ids]
 
+
+def _rake_iteration(
+        correctors: List[ArrayCorrector],
+        weights: np.ndarray,
+        cell_counts: np.ndarray,
+        cell_external_weights: np.ndarray,
+        n_rows: float | np.ndarray,
+        clip_range: Tuple[float, float],
+) -> float | np.ndarray:
+    """One raking iteration, updating the weights in place and returning the mean change (per replicate)."""
+    # Store a copy of the weights from the start of the iteration
+    prev_weights = weights.copy()
+
+    for corrector in correctors:
+        weights *= corrector(cell_external_weights * weights)
+
+    # Clip and renormalize the weights (means are over sample rows, not cells)
+    np.clip(weights, clip_range[0], clip_range[1], out=weights)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_weight = (weights * cell_counts).sum(axis=0) / n_rows
+    weights /= np.where(mean_weight > 0, mean_weight, 1.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (np.abs(weights - prev_weights) * cell_counts).sum(axis=0) / n_rows
+
+
+def _rake_cells(
+        correctors: List[ArrayCorrector],
+        cell_counts: np.ndarray,
+        cell_external_weights: np.ndarray,
+        iterations: int,
+        clip_range: Tuple[float, float],
+        tolerance: float,
+        initial_weights: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Raking loop over cells, each standing for `cell_counts` sample rows with a total
+    external weight of `cell_external_weights`.
+
+    With 2-D counts and external weights (one column per replicate), all replicates are raked
+    at once. Replicates that have converged are left out of further iterations, so every
+    replicate gets the same weights as if it was raked on its own.
+    """
+    n_rows = cell_counts.sum(axis=0)
+    weights = np.ones(cell_counts.shape) if initial_weights is None else \
+        np.broadcast_to(_as_column(initial_weights, cell_counts), cell_counts.shape).copy()
+    if np.all(n_rows == 0):
+        return weights
+
+    if weights.ndim == 1:
+        for i in range(iterations):
+            change = _rake_iteration(correctors, weights, cell_counts, cell_external_weights, n_rows, clip_range)
+            # Maybe early exit
+            if change < tolerance:
+                break
+        return weights
+
+    is_active = n_rows > 0
+    for i in range(iterations):
+        active_weights = weights[:, is_active]
+        change = _rake_iteration(
+            correctors, active_weights, cell_counts[:, is_active], cell_external_weights[:, is_active],
+            n_rows[is_active], clip_range
+        )
+        weights[:, is_active] = active_weights
+        is_active[is_active] = change >= tolerance
+        if not is_active.any():
+            break
     return weights
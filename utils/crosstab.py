@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Hashable, Iterable
+
+import numpy as np
+import pandas as pd
+
+from data.encoding import encode_column, with_missing
+
+
+@dataclass(frozen=True)
+class WeightedCrosstab:
+    """
+    Weighted distributions (and respondent counts) of many attributes, optionally crossed with
+    a grouping, see `weighted_crosstab`.
+
+    The sums and counts of every attribute have the shape ``(n_groups, n_labels)``
+    (a single group without grouping).
+    """
+    labels: dict[Hashable, pd.Index]
+    groups: pd.Index | None
+    sums: dict[Hashable, np.ndarray]
+    counts: dict[Hashable, np.ndarray]
+    name: Hashable = None
+    dropna: bool = False
+
+    def _observed(self, attribute: Hashable) -> np.ndarray:
+        """Mask of the observed cells (and not missing, if `dropna`)."""
+        is_observed = self.counts[attribute] > 0
+        if self.dropna:
+            is_observed[:, -1] = False
+            if self.groups is not None:
+                is_observed[-1] = False
+        return is_observed
+
+    def distribution(self, attribute: Hashable) -> pd.Series:
+        """
+        The weighted distribution of an attribute, like
+        ``df.groupby([by, attribute], observed=True, dropna=dropna)[weights].sum()``.
+        """
+        group_positions, label_positions = np.nonzero(self._observed(attribute))
+        labels = self.labels[attribute][label_positions]
+        index = labels if self.groups is None else pd.MultiIndex.from_arrays(
+            [self.groups[group_positions], labels], names=[self.groups.name, attribute]
+        )
+        return pd.Series(self.sums[attribute][group_positions, label_positions], index=index, name=self.name)
+
+    def to_frame(self) -> pd.DataFrame:
+        """All distributions as a long frame with one row per attribute, (group) and value."""
+        frames = []
+        for attribute, labels in self.labels.items():
+            group_positions, label_positions = np.nonzero(self._observed(attribute))
+            frame = {'attribute': np.full(len(label_positions), attribute, dtype=object)}
+            if self.groups is not None:
+                frame['group'] = self.groups[group_positions]
+            frames.append(pd.DataFrame(frame | {
+                'value': labels.astype(object)[label_positions],
+                'weight': self.sums[attribute][group_positions, label_positions],
+                'count': self.counts[attribute][group_positions, label_positions],
+            }))
+        return pd.concat(frames, ignore_index=True)
+
+
+def weighted_crosstab(
+        df: pd.DataFrame,
+        attributes: Iterable[Hashable],
+        weights: Hashable | pd.Series,
+        by: Hashable | pd.Series = None,
+        dropna: bool = False,
+) -> WeightedCrosstab:
+    """
+    Weighted distributions of many attributes in one pass.
+
+    All attribute columns (and the grouping) are factorized once, and the weights of all attributes
+    and groups are summed with a single `np.bincount`. Missing values are a value of their own, like
+    ``groupby(..., dropna=False)``, unless `dropna`.
+
+    Args:
+        df: The DataFrame with the attributes
+        attributes: The attribute columns
+        weights: The weights column (or Series aligned with the rows), missing weights count as zero
+        by: Optional grouping column (or Series aligned with the rows, e.g. binned ages) to cross all attributes with
+        dropna: Whether to leave out missing attribute values and groups
+
+    Returns:
+        The distributions, see `WeightedCrosstab`
+    """
+    attributes = list(attributes)
+    weights = df[weights] if not isinstance(weights, pd.Series) else weights
+    weight_values = np.nan_to_num(weights.to_numpy(np.float64, na_value=np.nan), nan=0.0)
+    if by is None:
+        group_codes, groups = np.zeros(len(df), dtype=np.int64), None
+    else:
+        group_codes, groups = encode_column(df[by] if not isinstance(by, pd.Series) else by, sort=True, observed=False)
+        groups = with_missing(groups)
+    n_groups = 1 if groups is None else len(groups)
+
+    # Codes of all attributes, offset so that all labels of all attributes are distinct, labels are sorted
+    # (categories in their order) with the missing value last, like a ``groupby(..., dropna=False)``
+    labels, codes, offsets = {}, [], [0]
+    for attribute in attributes:
+        attribute_codes, uniques = encode_column(df[attribute], sort=True, observed=False)
+        labels[attribute] = with_missing(uniques)
+        codes.append(attribute_codes + offsets[-1])
+        offsets.append(offsets[-1] + len(labels[attribute]))
+    n_labels = offsets[-1]
+    keys = (group_codes[:, None] * n_labels + np.column_stack(codes)).ravel() if attributes else \
+        np.zeros(0, dtype=np.int64)
+    sums = np.bincount(keys, weights=np.repeat(weight_values, len(attributes)), minlength=n_groups * n_labels)
+    counts = np.bincount(keys, minlength=n_groups * n_labels)
+    sums, counts = sums.reshape(n_groups, n_labels), counts.reshape(n_groups, n_labels)
+
+    return WeightedCrosstab(
+        labels=labels,
+        groups=groups,
+        sums={attribute: sums[:, start:end] for attribute, start, end in zip(attributes, offsets, offsets[1:])},
+        counts={attribute: counts[:, start:end] for attribute, start, end in zip(attributes, offsets, offsets[1:])},
+        name=weights.name,
+        dropna=dropna,
+    )
@@ -8,12 +8,68 @@ def merge_proportional(distribution: pd.Series, *distributions: tuple[pd.Series,
     """
     distributions = [distribution] + list(distributions)
     # Ensure all series have a name for the concat keys
-    named_distributions = []
-    for i, d in enumerate(distributions):
-        if d.name is None:
-            d.name = f'dist_{i}'
-        named_distributions.append(d)
-    return pd.concat([d / d.sum() for d in named_distributions if d.sum() > 0], axis=1)
+    named_distributions = [
+        d if d.name is not None else d.rename(f'dist_{i}')
+        for i, d in enumerate(distributions)
+    ]
+    merged = pd.concat([d for d in named_distributions if d.sum() > 0], axis=1)
+    return merged / merged.sum().to_numpy()
+
+
+def align_distributions(*distributions: pd.Series) -> tuple[np.ndarray, pd.Index]:
+    """
+    Align distributions on a shared category index, once for all array-level operations.
+
+    Returns:
+        Matrix of shape ``(n_categories, n_distributions)`` with zeros for missing categories and
+        the shared category index
+    """
+    index = distributions[0].index
+    for distribution in distributions[1:]:
+        if not distribution.index.equals(index):
+            index = index.union(distribution.index, sort=False)
+    matrix = np.column_stack([
+        distribution.reindex(index).to_numpy(np.float64, na_value=np.nan) for distribution in distributions
+    ])
+    return np.nan_to_num(matrix, nan=0.0), index
+
+
+def normalize_distributions(matrix: np.ndarray) -> np.ndarray:
+    """Normalize every column of a distribution matrix to sum to 1 (NaN for empty columns, missing values are ignored)."""
+    sums = np.nansum(matrix, axis=0)
+    return matrix / np.where(sums > 0, sums, np.nan)
+
+
+def total_variance_distances(matrix: np.ndarray, reference: int | np.ndarray) -> np.ndarray:
+    """
+    Total Variation Distance between every column of a distribution matrix and a reference.
+
+    Args:
+        matrix: Distributions of shape ``(n_categories, n_distributions)``, see `align_distributions`
+        reference: Position of the reference column or a reference distribution of shape ``(n_categories,)``
+
+    Returns:
+        The distance of every column (NaN for empty columns or an empty reference)
+    """
+    shares = normalize_distributions(np.asarray(matrix, dtype=np.float64))
+    reference_shares = shares[:, reference] if isinstance(reference, (int, np.integer)) else \
+        normalize_distributions(np.asarray(reference, dtype=np.float64)[:, None])[:, 0]
+    distances = 0.5 * np.nansum(np.abs(shares - reference_shares[:, None]), axis=0)
+    is_empty = np.all(np.isnan(shares), axis=0) | np.all(np.isnan(reference_shares))
+    return np.where(is_empty, np.nan, distances)
+
+
+def pairwise_total_variance_distances(matrix: np.ndarray) -> np.ndarray:
+    """
+    Total Variation Distance between all pairs of columns of a distribution matrix.
+
+    Returns:
+        Symmetric matrix of shape ``(n_distributions, n_distributions)`` (NaN for empty columns)
+    """
+    shares = normalize_distributions(np.asarray(matrix, dtype=np.float64))
+    distances = 0.5 * np.nansum(np.abs(shares[:, :, None] - shares[:, None, :]), axis=0)
+    is_empty = np.all(np.isnan(shares), axis=0)
+    return np.where(is_empty[:, None] | is_empty[None, :], np.nan, distances)
 
 
 def total_variance_distance(distribution1: pd.Series, distribution2: pd.Series) -> float:
@@ -29,9 +85,10 @@ def column_total_variance_distance(distribution: pd.DataFrame, reference: str) -
     """
     Calculate Total Variation Distance between each column and a reference column.
     """
+    columns = [col for col in distribution.columns if col != reference]
     if reference not in distribution.columns or distribution[reference].sum() == 0:
-        return pd.Series({col: np.nan for col in distribution.columns if col != reference})
-    return pd.Series({
-        column: total_variance_distance(distribution[column], distribution[reference])
-        for column in distribution.columns if column != reference
-    })
+        return pd.Series(np.nan, index=columns)
+    return pd.Series(total_variance_distances(
+        distribution[columns].to_numpy(np.float64, na_value=np.nan),
+        distribution[reference].to_numpy(np.float64, na_value=np.nan),
+    ), index=columns)